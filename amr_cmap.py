@@ -4,10 +4,26 @@ Convert document AMRs to one cmap representations.
 @Author: Hardy
 """
 import argparse
+import os
+import sys
+import subprocess
 from sklearn.neural_network import MLPRegressor
 from utils.AmrReader import AMRReader
 from utils.PropBankReader import PropBankReader
+from utils.AmrGraphStore import AMRGraphStore
+from utils.ShardMerger import ShardMerger, parse_shard, shard_output_path
+from utils.StageManifest import StageManifest, files_fingerprint, dir_fingerprint, code_fingerprint
+from utils.SegmentStore import SegmentStore
+from utils.TokenVocab import TokenStore
+from amr_hackathon import amr
+from amr_lib.CMapMerger import DocumentCMapMerger
+from amr_lib.CMapGraph import CMapGraph
 from amr_lib.AMRtoTriples import AMRCorpusExtConverter
+from amr_lib.TriplesMemo import TriplesMemo
+from amr_lib.TriplesExporter import TriplesExporter
+from amr_lib.ConceptSalience import ConceptSalience
+from amr_lib.TriplesIndex import TriplesIndex
+from amr_lib.Backends import SubprocessBackend, StubGeneratorBackend, StubOpenIEBackend
 
 
 def init_args():
@@ -15,10 +31,62 @@ def init_args():
     parser.add_argument('--amr_path', help='Gold standard AMR directory.')
     parser.add_argument('--output_path', help='Output directory.')
     parser.add_argument('--propbank_path', help='Propbank directory.')
+    parser.add_argument('--splits', help='Only read these splits, e.g. dev test.', nargs='+')
+    parser.add_argument('--snt_types', help='Only read sentences of these types, e.g. summary.', nargs='+')
+    parser.add_argument('--doc_pattern', help='Only read documents whose id contains a match of this regular '
+                                              'expression (anchor it with ^ to match from the start).')
+    parser.add_argument('--load_workers', help='Number of processes reading the split files.', type=int, default=1)
+    parser.add_argument('--parse_on_load', help='Parse the AMRs while loading the split files', action='store_true')
     parser.add_argument('--gen_token', help='Generate token for OpenIE.', action='store_true')
     parser.add_argument('--gen_amr_string_triples', help='Generate AMR string triples for AMR generator',
                         action='store_true')
+    parser.add_argument('--dedup_amr_string', help='Write each unique AMR string once, with a mapping file',
+                        action='store_true')
     parser.add_argument('--write_triples', help='Write triples to files', action='store_true')
+    parser.add_argument('--run_backends', help='Run the AMR generator and OpenIE back-ends before writing triples',
+                        choices=['stub', 'command'])
+    parser.add_argument('--generator_cmd', help='Shell command of the AMR generator, one AMR string per line.')
+    parser.add_argument('--openie_cmd', help='Shell command of OpenIE, one sentence per line.')
+    parser.add_argument('--backend_concurrency', help='Number of concurrent back-end batches.', type=int, default=4)
+    parser.add_argument('--backend_batch_size', help='Number of inputs per back-end batch.', type=int, default=32)
+    parser.add_argument('--align_openie', help='Match the triples with the OpenIE extractions by token spans',
+                        action='store_true')
+    parser.add_argument('--merge_cmaps', help='Merge sentence triples into one concept map per document',
+                        action='store_true')
+    parser.add_argument('--merge_unnamed', help='Also merge unnamed concepts across sentences when merging cmaps',
+                        action='store_true')
+    parser.add_argument('--export_cmap_graphs', help='Export the merged cmaps as sparse graphs with salience, and '
+                                                     'optionally as GraphML / edge list files.', nargs='*',
+                        choices=['graphml', 'edgelist'])
+    parser.add_argument('--memo_size', help='Number of converted sentences kept for duplicate AMRs (0 disables).',
+                        type=int, default=10000)
+    parser.add_argument('--memo_persist', help='Keep the triples memo on disk between runs', action='store_true')
+    parser.add_argument('--export', help='Stream the converted triples to output_path/data/export.',
+                        choices=['jsonl', 'parquet'])
+    parser.add_argument('--salience_top_k', help='Prune the triples of every document to its k most salient concepts '
+                                                 'before generating the AMR strings.', type=int)
+    parser.add_argument('--salience', help='Concept salience score used for pruning.', choices=['tfidf', 'frequency'],
+                        default='tfidf')
+    parser.add_argument('--threads', help='Number of threads converting the sentences.', type=int, default=1)
+    parser.add_argument('--build_index', help='Build the inverted index of the triples for amr_lib.TriplesIndex '
+                                              'queries', action='store_true')
+    parser.add_argument('--low_memory', help='Keep only plain string triples and the compact PropBank agent table '
+                                             'in memory during conversion', action='store_true')
+    parser.add_argument('--rebuild', help='Re-run these stages even if their inputs did not change.', nargs='+',
+                        choices=['corpus', 'graph_store', 'propbank', 'propbank_agents', 'triples', 'index', 'cmaps',
+                                 'cmap_graphs', 'tokens'],
+                        default=[])
+    parser.add_argument('--hash_inputs', help='Fingerprint the input files by content instead of size and mtime',
+                        action='store_true')
+    parser.add_argument('--append_path', help='Read and convert the documents of another AMR directory (same layout '
+                                              'as amr_path) and append them to the stored corpus, then exit. A '
+                                              'rebuild of the corpus only reads amr_path again.')
+    parser.add_argument('--compact', help='Fold the appended segments into the corpus pickles', action='store_true')
+    parser.add_argument('--shard', help='Only convert shard i/n of the documents, into output_path/shards/i_of_n.')
+    parser.add_argument('--merge_shards', help='Merge the outputs of n shards into output_path/data first.', type=int)
+    parser.add_argument('--local_shards', help='Run n shards as local processes, then merge them.', type=int)
+    parser.add_argument('--build_graph_store', help='Build the memory-mapped AMR graph store for random access',
+                        action='store_true')
     args = parser.parse_args()
     if not args.amr_path:
         raise Exception("No AMR directory is specified.")
@@ -26,47 +94,267 @@ def init_args():
         raise Exception("No output directory is specified.")
     if not args.propbank_path:
         raise Exception("No propbank directory is specified.")
+    if args.run_backends == 'command' and not (args.generator_cmd and args.openie_cmd):
+        raise Exception("No back-end command is specified.")
+    if args.shard and (args.merge_shards or args.local_shards):
+        raise Exception("A shard run can not merge shards.")
+    if args.salience_top_k and (args.shard or args.merge_shards or args.local_shards):
+        raise Exception("Salience pruning is computed over the whole corpus, it can not be sharded.")
+    if args.append_path and (args.shard or args.merge_shards or args.local_shards or args.salience_top_k):
+        raise Exception("Documents can not be appended by sharded or salience pruned runs.")
     return args
 
 
+PROPBANK_STAGES = {'propbank', 'propbank_agents'}
+
+
+def load_propbank(args, output_path, manifest):
+    """
+    Load the propbank, or with low_memory its agent table, rebuilding it when the frames or the reader changed.
+    Returns the propbank fingerprint and data.
+    """
+    fingerprint = manifest.fingerprint({'frames': dir_fingerprint(args.propbank_path, args.hash_inputs),
+                                        'code': code_fingerprint(PropBankReader)})
+    propbank_reader = PropBankReader(args.propbank_path, output_path)
+    current = manifest.is_current('propbank', fingerprint)
+    if not current:
+        propbank_reader.build_data()
+        propbank_reader.save_data()
+        manifest.record('propbank', fingerprint, [os.path.join(output_path, 'data', 'propbank.pickle')])
+    if args.low_memory:
+        # only the agent arguments of the rolesets are needed, the DOM trees are not kept
+        agents_file = os.path.join(output_path, 'data', 'propbank_agents.pickle')
+        if current and manifest.is_current('propbank_agents', fingerprint):
+            return fingerprint, propbank_reader.agent_table()
+        if os.path.isfile(agents_file):
+            os.remove(agents_file)
+        agent_table = propbank_reader.agent_table()
+        manifest.record('propbank_agents', fingerprint, [agents_file])
+        return fingerprint, agent_table
+    return fingerprint, propbank_reader.load_data() if current else propbank_reader.propbank
+
+
+def run_local_shards(args):
+    """
+    Convert every shard in its own process, with the arguments of this run.
+    Only the conversion is sharded, the steps that follow are run once on the merged corpus.
+    """
+    # build the shared propbank pickle once, instead of in every shard
+    manifest = StageManifest(args.output_path)
+    for stage in set(args.rebuild) & PROPBANK_STAGES:
+        manifest.invalidate(stage)
+    load_propbank(args, args.output_path, manifest)
+    shard_argv = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg == '--local_shards':
+            skip = True
+        elif not arg.startswith('--local_shards='):
+            shard_argv.append(arg)
+    for arg in ('--gen_token', '--gen_amr_string_triples', '--write_triples', '--merge_cmaps', '--build_index'):
+        if arg in shard_argv:
+            shard_argv.remove(arg)
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__)] + shard_argv
+                              + ['--shard', str(i) + '/' + str(args.local_shards)])
+             for i in range(args.local_shards)]
+    for i, proc in enumerate(procs):
+        if proc.wait() != 0:
+            raise Exception('Shard ' + str(i) + '/' + str(args.local_shards) + ' failed')
+
+
 def main(args):
-    # initialize AMR Reader for loading the amr corpus
-    amr_reader = AMRReader(args.amr_path, args.output_path)
-    # if amr_corpus file doesn't exist rebuild the corpus and save data
-    if amr_reader.is_file_exist():
+    if args.local_shards:
+        run_local_shards(args)
+        args.merge_shards = args.local_shards
+
+    # a shard reads only its own documents, and writes everything but the propbank under its own directory
+    shard = None
+    propbank_output_path = args.output_path
+    if args.shard:
+        shard = parse_shard(args.shard)
+        args.output_path = shard_output_path(args.output_path, *shard)
+    data_path = os.path.join(args.output_path, 'data')
+
+    # fingerprints of the stages, a stage is only re-run when its fingerprint changed (see StageManifest)
+    manifest = StageManifest(args.output_path)
+    # the propbank of shards is shared, and kept up to date by the run that starts them
+    propbank_manifest = StageManifest(propbank_output_path) if shard else manifest
+    for stage in args.rebuild:
+        if stage not in PROPBANK_STAGES:
+            manifest.invalidate(stage)
+        elif not shard:
+            propbank_manifest.invalidate(stage)
+    amr_reader = AMRReader(args.amr_path, args.output_path, args.splits, args.snt_types, args.doc_pattern, shard)
+    amrs_files, align_files = amr_reader.find_split_files()
+    corpus_fingerprint = manifest.fingerprint({
+        'inputs': files_fingerprint(list(amrs_files.values()) + list(align_files.values()), args.hash_inputs),
+        'splits': sorted(args.splits or []), 'snt_types': sorted(args.snt_types or []),
+        'doc_pattern': args.doc_pattern, 'shard': args.shard, 'code': code_fingerprint(AMRReader, TokenStore)})
+    propbank_fingerprint, propbank_data = load_propbank(args, propbank_output_path, propbank_manifest)
+    # the salience of the concepts is computed with the concept keys of the cmap merger
+    converter_code = code_fingerprint(AMRCorpusExtConverter, ConceptSalience, DocumentCMapMerger, amr,
+                                      os.path.join(os.path.dirname(amr.__file__), 'amr.peg'))
+    triples_fingerprint = manifest.fingerprint({'corpus': corpus_fingerprint, 'propbank': propbank_fingerprint,
+                                                'low_memory': args.low_memory, 'code': converter_code,
+                                                'salience': [args.salience_top_k, args.salience]})
+    corpus_file = os.path.join(data_path, 'amr_corpus.pickle')
+    corpus_ext_file = os.path.join(data_path, 'amr_corpus_ext.pickle')
+
+    # append new documents as segments of the stored corpus, only the new documents are read and converted
+    ext_store = SegmentStore(data_path, 'amr_corpus_ext')
+    if args.append_path or args.compact:
+        corpus_current = manifest.is_current('corpus', corpus_fingerprint) and amr_reader.is_file_exist()
+        triples_current = manifest.is_current('triples', triples_fingerprint)
+        if args.append_path:
+            if not (corpus_current and triples_current):
+                raise Exception("The corpus has to be built and converted before documents are appended to it.")
+            append_reader = AMRReader(args.append_path, args.output_path, args.splits, args.snt_types,
+                                      args.doc_pattern)
+            new_corpus = append_reader.build_corpus(args.load_workers, args.parse_on_load)
+            append_reader.append_data()
+            append_converter = AMRCorpusExtConverter(new_corpus, propbank_data, args.output_path,
+                                                     low_memory=args.low_memory, threads=args.threads)
+            append_converter.update_amr_corpus_with_triples()
+            append_converter.append_data()
+            print('Appended ' + str(sum(len(dataset) for dataset in new_corpus.values())) + ' documents')
+            # the graph store, the index, the cmaps and their graphs do not have the new documents
+            manifest.invalidate('graph_store')
+            manifest.invalidate('index')
+            manifest.invalidate('cmaps')
+            manifest.invalidate('cmap_graphs')
+        if args.compact:
+            amr_reader.store.compact()
+            ext_store.compact()
+        if corpus_current:
+            manifest.record('corpus', corpus_fingerprint, amr_reader.store.files())
+        if triples_current:
+            manifest.record('triples', triples_fingerprint, ext_store.files())
+        if args.append_path:
+            return
+
+    # merge the shard outputs, the merged corpus is then loaded like the one of an unsharded run
+    if args.merge_shards:
+        merge_reader = AMRReader(args.amr_path, args.output_path, args.splits)
+        shard_merger = ShardMerger(args.output_path, args.merge_shards, merge_reader.document_order())
+        merged = shard_merger.merge()
+        print('Merged ' + ', '.join(merged))
+        # the shards were run on the current inputs, with the filters of this run
+        amr_reader.save_filters()
+        manifest.record('corpus', corpus_fingerprint, [corpus_file])
+        if 'amr_corpus_ext.pickle' in merged:
+            manifest.record('triples', triples_fingerprint, [corpus_ext_file])
+
+    # rebuild the corpus only when the AMR files, the filters or the reader changed
+    if manifest.is_current('corpus', corpus_fingerprint) and amr_reader.is_file_exist():
         amr_corpus = amr_reader.load_data()
     else:
-        amr_corpus = amr_reader.build_corpus()
+        amr_corpus = amr_reader.build_corpus(args.load_workers, args.parse_on_load)
         amr_reader.save_data()
+        manifest.record('corpus', corpus_fingerprint, [corpus_file])
 
-    # initialize Propbank Reader for loading the probank data
-    propbank_reader = PropBankReader(args.propbank_path, args.output_path)
-    if propbank_reader.is_file_exist():
-        propbank_data = propbank_reader.load_data()
-    else:
-        propbank_data = propbank_reader.build_data()
-        propbank_reader.save_data()
+    # build the graph store once, for random access to single sentences by id
+    if args.build_graph_store:
+        graph_store = AMRGraphStore(args.output_path)
+        graph_store_fingerprint = manifest.fingerprint({'corpus': corpus_fingerprint,
+                                                        'code': code_fingerprint(AMRGraphStore)})
+        if not manifest.is_current('graph_store', graph_store_fingerprint):
+            graph_store.build(amr_corpus)
+            manifest.record('graph_store', graph_store_fingerprint,
+                            [os.path.join(data_path, 'amr_graph.bin'), os.path.join(data_path, 'amr_graph.idx')])
+
+    memo = None
+    if args.memo_size > 0:
+        # memoized results are only valid for the propbank and converter they were computed with
+        memo_path = os.path.join(data_path, 'triples_memo.pickle') if args.memo_persist else None
+        memo_fingerprint = manifest.fingerprint({'propbank': propbank_fingerprint, 'low_memory': args.low_memory,
+                                                 'code': converter_code})
+        memo = TriplesMemo(args.memo_size, memo_path, memo_fingerprint)
+    amr_corpus_ext_converter = AMRCorpusExtConverter(amr_corpus, propbank_data, args.output_path, memo,
+                                                     args.low_memory, args.threads)
 
+    exporter = None
+    if args.export:
+        exporter = TriplesExporter(os.path.join(args.output_path, 'data', 'export', 'triples.' + args.export),
+                                   args.export)
 
-    amr_corpus_ext_converter = AMRCorpusExtConverter(amr_corpus, propbank_data, args.output_path)
+    # the triples index is built along with the triples, or from the saved triples when only the index is stale
+    index = None
+    index_file = os.path.join(data_path, 'triples_index.pickle')
+    index_fingerprint = manifest.fingerprint({'triples': triples_fingerprint,
+                                              'code': code_fingerprint(TriplesIndex, DocumentCMapMerger)})
+    if args.build_index and not manifest.is_current('index', index_fingerprint):
+        index = TriplesIndex(args.output_path)
 
     # update amr_corpus with triples
-    if amr_corpus_ext_converter.is_file_exist():
+    if manifest.is_current('triples', triples_fingerprint):
         amr_corpus = amr_corpus_ext_converter.load_data()
+        if exporter is not None:
+            amr_corpus_ext_converter.export_triples(exporter)
+        if index is not None:
+            amr_corpus_ext_converter.export_triples(index)
     else:
-        amr_corpus = amr_corpus_ext_converter.update_amr_corpus_with_triples()
+        salience = ConceptSalience(args.salience_top_k, args.salience) if args.salience_top_k else None
+        amr_corpus = amr_corpus_ext_converter.update_amr_corpus_with_triples(exporter, salience, index)
         amr_corpus_ext_converter.save_data()
+        manifest.record('triples', triples_fingerprint, [corpus_ext_file])
+        if memo is not None and salience is None:
+            print(memo.summary())
+            if args.memo_persist:
+                memo.save_data()
+    if exporter is not None:
+        exporter.close()
+    if index is not None:
+        index.close()
+        manifest.record('index', index_fingerprint, [index_file])
+
+    if args.merge_cmaps or args.export_cmap_graphs is not None:
+        cmaps_fingerprint = manifest.fingerprint({'triples': triples_fingerprint, 'merge_unnamed': args.merge_unnamed,
+                                                  'code': code_fingerprint(DocumentCMapMerger)})
+        if manifest.is_current('cmaps', cmaps_fingerprint):
+            amr_corpus_ext_converter.load_cmaps()
+        else:
+            amr_corpus_ext_converter.merge_document_cmaps(args.merge_unnamed)
+            amr_corpus_ext_converter.save_cmaps()
+            manifest.record('cmaps', cmaps_fingerprint, [os.path.join(data_path, 'amr_cmaps.pickle')])
+    if args.export_cmap_graphs is not None:
+        graphs_fingerprint = manifest.fingerprint({'cmaps': cmaps_fingerprint,
+                                                   'formats': sorted(args.export_cmap_graphs),
+                                                   'code': code_fingerprint(CMapGraph)})
+        if not manifest.is_current('cmap_graphs', graphs_fingerprint):
+            amr_corpus_ext_converter.export_cmap_graphs(args.export_cmap_graphs)
+            manifest.record('cmap_graphs', graphs_fingerprint, [os.path.join(data_path, 'cmap_graphs.pickle')])
 
     # exit program when finished
     if args.gen_token or args.gen_amr_string_triples:
         if args.gen_token:
-            amr_corpus_ext_converter.write_tok_to_file()
+            # the token files only depend on the sentences with triples, they are rewritten when those change,
+            # including the documents appended as segments
+            tokens_fingerprint = manifest.fingerprint({'triples': triples_fingerprint,
+                                                       'segments': files_fingerprint(ext_store.files()),
+                                                       'code': code_fingerprint(TokenStore)})
+            if not manifest.is_current('tokens', tokens_fingerprint):
+                manifest.record('tokens', tokens_fingerprint, amr_corpus_ext_converter.write_tok_to_file())
         if args.gen_amr_string_triples:
-            amr_corpus_ext_converter.write_amr_string_to_file()
+            amr_corpus_ext_converter.write_amr_string_to_file(args.dedup_amr_string)
         return
 
+    if args.run_backends == 'stub':
+        amr_corpus_ext_converter.run_backends(StubGeneratorBackend(), StubOpenIEBackend(),
+                                              args.backend_concurrency, args.backend_batch_size)
+    elif args.run_backends == 'command':
+        amr_corpus_ext_converter.run_backends(SubprocessBackend(args.generator_cmd),
+                                              SubprocessBackend(args.openie_cmd, block_output=True),
+                                              args.backend_concurrency, args.backend_batch_size)
+
+    if args.align_openie:
+        for dataset_name, (precision, recall) in amr_corpus_ext_converter.align_openie().items():
+            print(dataset_name + ' OpenIE precision: %.4f, AMR triple recall: %.4f' % (precision, recall))
+
     if args.write_triples:
-        amr_corpus_ext_converter.write_triples_to_files()
+        # back-ends run by the pipeline get every amr_string, so there is nothing to expand
+        amr_corpus_ext_converter.write_triples_to_files(args.dedup_amr_string and not args.run_backends)
 
 
 
@@ -9,15 +9,23 @@ When called directly, this script runs some cursory unit tests.
 
 If the AMR has ISI-style inline alignments, those are stored in the AMR object as well.
 
-TODO: Include the smatch evaluation code
-(released at http://amr.isi.edu/evaluation.html under the MIT License).
+Parsing is reentrant and AMR objects can be read from several threads: the structures a lazy AMR
+derives on first access are built under a lock and only published once complete.
+
+Smatch evaluation over the triples of this class is implemented in amr_lib/Smatch.py
+(following the scorer released at http://amr.isi.edu/evaluation.html under the MIT License).
 
 @author: Nathan Schneider (nschneid@inf.ed.ac.uk)
 @since: 2015-05-05
 '''
 from __future__ import print_function
 
+import os
 import re
+import threading
+from io import StringIO
+from itertools import chain
+from array import array
 from collections import defaultdict, Counter
 
 from nltk.parse import DependencyGraph
@@ -25,11 +33,81 @@ from parsimonious.exceptions import ParseError
 from parsimonious.grammar import Grammar
 
 
+def parse_alignment(align_key):
+    '''
+    Token offsets of an alignment key like "e.10" (single token offset) or "e.10,11" (multiple)
+
+    >>> parse_alignment('e.10,11')
+    [10, 11]
+    '''
+    return [int(woffset) for woffset in align_key.split('.')[-1].split(',')]
+
+def write_penman(triples, out, align=None, role_align=None, compressed=False, indent=' '*4, skip=()):
+    '''
+    Write the Penman serialization of triples in traversal order (as returned by AMR.triples()) to the
+    stream out while walking them, one line per relation or, compressed, the whole graph on a single line.
+    A node is only opened once its concept is seen, so nothing written has to be taken back.
+    Relations in skip are left out.
+
+    >>> out = StringIO()
+    >>> write_penman(AMR('(h / hug-01 :ARG0 (p / person) :ARG1 p :polarity -)').triples(), out, compressed=True)
+    >>> out.getvalue()
+    '(h / hug-01 :ARG0 (p / person) :ARG1 p :polarity -)'
+    '''
+    align = align or {}
+    role_align = role_align or {}
+    stack = []
+    pending = None  # the node last opened, until it turns out whether it has a concept
+    concept_stack_depth = {None: 0} # size of the stack when the :instance-of triple was encountered for the variable
+    for h, r, d in chain(triples, [(None, None, None)]):
+        if r in skip:
+            continue
+        align_key = align.get((h, r, d), '')
+        role_align_key = role_align.get((h, r, d), '')
+        if r==':top':
+            stack.append((h, r, d))
+            pending = ''
+        elif r==':instance-of':
+            out.write('(' + stack[-1][2](pending) + ' / ' + d(align_key))
+            pending = None
+            concept_stack_depth[h] = len(stack)
+        elif h==stack[-1][2] and r==':polarity':   # polarity gets to be on the same line as the concept
+            out.write(' ' + r + role_align_key + ' ' + d(align_key))
+        else:
+            while len(stack)>concept_stack_depth[h]:
+                h2, r2, d2 = stack.pop()
+                if pending is not None:
+                    # just a variable or constant with no concept hanging off of it, so no parens
+                    out.write(d2(align.get((h2, r2, d2), ''), append=True))
+                else:
+                    out.write(')')
+                pending = None
+            if d is not None:
+                out.write((' ' if compressed else '\n' + indent*len(stack)) + r + role_align_key + ' ')
+                stack.append((h, r, d))
+                pending = align_key
+
 def clean_grammar_file(s):
     return re.sub('\n[ \t]+', ' ', re.sub(r'#.*','',s.replace('\t',' ').replace('`','_backtick')))
 
-with open('/home/acp16hh/Projects/Research/Exp_2_Slot_filling_NLG/source_code/AMR_Slot_Filling/amr_hackathon/amr.peg') as inF:
-    grammar = Grammar(clean_grammar_file(inF.read()))
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'amr.peg')
+
+# The grammar is compiled on first use and never changes after; parsimonious keeps the state of a parse
+# local to the parse, so one grammar is shared by all threads.
+_grammar = None
+_grammar_lock = threading.Lock()
+
+def get_grammar():
+    '''
+    The compiled AMR grammar, loaded from amr.peg next to this module
+    '''
+    global _grammar
+    if _grammar is None:
+        with _grammar_lock:
+            if _grammar is None:
+                with open(GRAMMAR_PATH) as inF:
+                    _grammar = Grammar(clean_grammar_file(inF.read()))
+    return _grammar
 
 
 class Var(object):
@@ -95,6 +173,41 @@ class AMRNumber(AMRConstant):
     def __repr__(self):
         return 'Num('+self._value+')'
 
+class Relation(object):
+    '''
+    Attributes of a relation label, computed once per label when an AMR is built:
+    is_core (an :ARGx role, including :ARGx-of), is_inverse (a :REL-of edge),
+    arg_num (the x of :ARGx as a string, None otherwise) and base (the label without -of).
+
+    >>> r = Relation(':ARG1-of')
+    >>> r.is_core, r.is_inverse, r.arg_num, r.base
+    (True, True, '1', ':ARG1')
+    >>> r = Relation(':mod')
+    >>> r.is_core, r.is_inverse, r.arg_num, r.base
+    (False, False, None, ':mod')
+    '''
+    RE_ARG_NUM = re.compile(r':ARG(\d+)')
+    __slots__ = ('label', 'base', 'is_core', 'is_inverse', 'arg_num')
+    def __init__(self, label):
+        self.label = label
+        self.is_inverse = label.endswith('-of')
+        self.base = label[:-3] if self.is_inverse else label
+        self.is_core = label.startswith(':ARG')
+        m = self.RE_ARG_NUM.match(label)
+        self.arg_num = m.group(1) if m else None
+    def __repr__(self):
+        return 'Relation('+self.label+')'
+
+
+def new_node():
+    '''Empty DependencyGraph node. A module-level function (not a lambda), so AMR objects can be pickled.'''
+    return {'address': None,
+            'type': None,
+            'head': None,
+            'rel': None,
+            'word': None,
+            'deps': []}
+
 
 class AMRError(Exception):
     pass
@@ -296,7 +409,7 @@ class AMR(DependencyGraph):
                                 :op1 "ERK"~e.22[ERK])))))))
     '''
 
-    def __init__(self, anno, tokens=None):
+    def __init__(self, anno, tokens=None, lazy=False):
         '''
         Given a Penman annotation string for a single rooted AMR, construct the data structure.
         Triples are stored internally in an order that preserves the layout of the
@@ -307,20 +420,37 @@ class AMR(DependencyGraph):
         there is not a 1-to-1 mapping between (unique) variables and concepts.
         Will not check details such as the appropriateness of relation/role names
         or constants. Does not currently read or store metadata about the AMR.
+
+        With lazy=True, only the triples and concepts are built up front; alignments,
+        constants and the DependencyGraph node table are derived on first access.
+
+        >>> a = AMR('(h / hug-01~e.1 :ARG1 (p / person :ARG0-of h))', lazy=True)
+        >>> a.triples(rel='core')
+        [(Var(h), ':ARG1', Var(p)), (Var(p), ':ARG0-of', Var(h))]
+        >>> a._nodes is None
+        True
+        >>> a.alignments()
+        {(Var(h), ':instance-of', Concept(hug-01)): 'e.1'}
+        >>> sorted(a.contains_cycle(), key=str)
+        [Var(h), Var(p)]
         '''
         self._v2c = {}
         self._triples = []
-        self._constants = set()
-        self._alignments = {}
-        self._role_alignments = {}
         self._tokens = tokens
+        # relation table: every relation label of the AMR (one shared string per label) -> its Relation
+        self._relations = {}
+        # Derived structures: the raw material is collected while walking the parse,
+        # the structures themselves are built by _materialize()
+        self._constants = None
+        self._alignments = None
+        self._role_alignments = None
+        self._nodes = None
+        self._alignment_list = []
+        self._role_alignment_list = []
+        self._node_ops = []
+        # serializes the lazy building of the derived structures of this AMR when it is shared between threads
+        self._lock = threading.RLock()
 
-        self.nodes = defaultdict(lambda: {'address': None,
-                                          'type': None,
-                                          'head': None,
-                                          'rel': None,
-                                          'word': None,
-                                          'deps': []})
         # Emulate the DependencyGraph (superclass) data structures somewhat.
         # There are some differences, e.g., in AMR it is possible for a node to have
         # multiple dependents with the same relation; so here, 'deps' is simply a list
@@ -328,21 +458,167 @@ class AMR(DependencyGraph):
         # In typical depenency graphs, 'word' is a word in the sentence
         # and 'address' is its index; here, both point to the object representing
         # the node's AMR variable, concept, or constant.
-
-        TOP = Var('TOP')
-        self.nodes[TOP]['address'] = self.nodes[TOP]['word'] = TOP
-        self.nodes[TOP]['type'] = 'TOP'
         if anno:
             self._anno = anno
             msg = ''
             try:
-                p = grammar.parse(anno)
+                p = get_grammar().parse(anno)
             except ParseError as e:
                 msg += '\n' + str(e)
                 p = None
             if p is None:
                 raise AMRSyntaxError('Well-formedness error in annotation:\n'+anno.strip()+msg)
             self._analyze(p)
+        if not lazy:
+            self._materialize()
+
+    def __getstate__(self):
+        # the lock is not pickled, a copy gets its own
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            self._build_nodes()
+        return self._nodes
+
+    @nodes.setter
+    def nodes(self, value):
+        self._nodes = value
+
+    def _build_nodes(self):
+        '''Build the DependencyGraph node table by replaying the node operations recorded by the parser.'''
+        with self._lock:
+            if self._nodes is not None:
+                return
+            nodes = defaultdict(new_node)
+            TOP = Var('TOP')
+            nodes[TOP]['address'] = nodes[TOP]['word'] = TOP
+            nodes[TOP]['type'] = 'TOP'
+            for address, t, rel, head, deps in self._node_ops:
+                if t is not None:
+                    node = {'address': address, 'word': address, 'type': t, 'rel': rel, 'head': head}
+                    if deps is not None:
+                        node['deps'] = deps
+                    if address not in nodes:    # DependencyGraph.add_node
+                        nodes[address].update(node)
+                else:
+                    nodes[address]['deps'].extend(deps)
+            self._nodes = nodes
+            self._node_ops = []
+
+    def _materialize(self):
+        '''Build all derived structures (alignments, constants and the node table) that are not built yet.'''
+        self._build_alignments()
+        self._build_constants()
+        if self._nodes is None:
+            self._build_nodes()
+
+    def _build_alignments(self):
+        '''
+        Build the alignment dicts, parsing every alignment key once into token offsets.
+        The offsets of all triples are stored in one integer array; each triple maps to its
+        (start, end) slice of that array.
+        '''
+        if self._alignments is not None:
+            return
+        with self._lock:
+            if self._alignments is not None:
+                return
+            alignments = dict(self._alignment_list)
+            role_alignments = dict(self._role_alignment_list)
+            offsets = array('i')
+            alignment_spans = {}
+            role_alignment_spans = {}
+            for aligned, spans in ((alignments, alignment_spans), (role_alignments, role_alignment_spans)):
+                for triple, align_key in aligned.items():
+                    start = len(offsets)
+                    offsets.extend(parse_alignment(align_key))
+                    spans[triple] = (start, len(offsets))
+            self._role_alignments = role_alignments
+            self._alignment_offsets = offsets
+            self._alignment_spans = alignment_spans
+            self._role_alignment_spans = role_alignment_spans
+            self._alignment_list = self._role_alignment_list = []
+            # published last, other threads only read the alignments once this is set
+            self._alignments = alignments
+
+    def alignment_offsets(self, triple, role=False):
+        '''
+        Token offsets a triple (or with role=True, its relation) is aligned to; empty if unaligned.
+
+        >>> a = AMR('(c / cat~e.1,8 :poss~e.0 (i / i~e.0,8))')
+        >>> a.alignment_offsets((Var('c'), ':instance-of', Concept('cat')))
+        (1, 8)
+        >>> a.alignment_offsets((Var('c'), ':poss', Var('i')), role=True)
+        (0,)
+        '''
+        self._build_alignments()
+        start, end = (self._role_alignment_spans if role else self._alignment_spans).get(triple, (0, 0))
+        return tuple(self._alignment_offsets[start:end])
+
+    def relation(self, label):
+        '''
+        The Relation of a relation label, from the relation table of this AMR
+
+        >>> a = AMR('(h / hug-01 :ARG1 (p / person :ARG0-of h))')
+        >>> a.relation(':ARG0-of').arg_num
+        '0'
+        '''
+        r = self._relations.get(label)
+        if r is None:
+            r = self._relations.setdefault(label, Relation(label))
+        return r
+
+    def _build_constants(self):
+        if self._constants is None:
+            self._constants = set(d for h, r, d in self._triples
+                                  if r not in (':top', ':instance-of') and d.is_constant())
+
+    @classmethod
+    def from_triples(cls, triples, alignments=None, role_alignments=None, tokens=None):
+        '''
+        Construct an AMR directly from an ordered list of triples (as returned by triples()),
+        bypassing the Penman parser. Alignments map triples to alignment keys such as "e.3,4".
+
+        >>> a = AMR('(h / hug-01 :ARG1 (p / person :ARG0-of h))')
+        >>> b = AMR.from_triples(a.triples())
+        >>> b
+        (h / hug-01
+            :ARG1 (p / person
+                :ARG0-of h))
+        >>> b.var2concept() == a.var2concept()
+        True
+        '''
+        a = cls(None, tokens, lazy=True)
+        for h, r, d in triples:
+            a.relation(r)
+            if r==':top':
+                a._node_ops.append((d, 'VAR', r, h, None))
+                continue
+            if r==':instance-of':
+                a._v2c[h] = d
+                t = 'CONCEPT'
+            elif isinstance(d, Var):
+                t = 'VAR'
+            elif isinstance(d, AMRString):
+                t = 'STR'
+            elif isinstance(d, AMRNumber):
+                t = 'NUM'
+            else:
+                t = 'NAMEDCONST'
+            a._node_ops.append((d, t, r, h, None))
+            a._node_ops.append((h, None, None, None, [d]))
+        a._triples = list(triples)
+        a._alignment_list = list((alignments or {}).items())
+        a._role_alignment_list = list((role_alignments or {}).items())
+        return a
 
     def triples(self, head=None, rel=None, dep=None, normalize_inverses=False, normalize_mod=False):  # overrides superclass implementation
         '''
@@ -369,18 +645,19 @@ class AMR(DependencyGraph):
         >>> a.triples(rel='core', normalize_inverses=True)
         [(Var(h), ':ARG1', Var(p)), (Var(h), ':ARG0', Var(p))]
         '''
+        relation = self.relation
         tt = (trip for trip in self._triples)
         if normalize_mod:
             tt = ((h,':domain-of',d) if r==':mod' else (h,r,d) for h,r,d in tt)
         if normalize_inverses:
-            tt = ((y,r[:-3],x) if r.endswith('-of') else (x,r,y) for x,r,y in tt)
+            tt = ((y,relation(r).base,x) if relation(r).is_inverse else (x,r,y) for x,r,y in tt)
         if head:
             tt = ((h,r,d) for h,r,d in tt if h in (head if hasattr(head,'__iter__') else (head,)))
         if rel:
             if rel=='core':
-                tt = ((h,r,d) for h,r,d in tt if r.startswith(':ARG'))
+                tt = ((h,r,d) for h,r,d in tt if relation(r).is_core)
             elif rel=='non-core':
-                tt = ((h,r,d) for h,r,d in tt if not r.startswith(':ARG'))
+                tt = ((h,r,d) for h,r,d in tt if not relation(r).is_core)
             else:
                 tt = ((h,r,d) for h,r,d in tt if r in (rel if hasattr(rel,'__iter__') else (rel)))
         if dep:
@@ -401,6 +678,7 @@ class AMR(DependencyGraph):
         return tt
 
     def constants(self):
+        self._build_constants()
         return self._constants
 
     def concept(self, variable):
@@ -413,9 +691,11 @@ class AMR(DependencyGraph):
         return dict(self._v2c)
 
     def alignments(self):
+        self._build_alignments()
         return dict(self._alignments)
 
     def role_alignments(self):
+        self._build_alignments()
         return dict(self._role_alignments)
 
     def tokens(self):
@@ -451,52 +731,33 @@ class AMR(DependencyGraph):
                 :ARG0 p
                 :ARG1 p)
             :mod (s / strange))
+        >>> print(a(compressed=True))
+        (p / person :ARG0-of (h / hug-01 :ARG0 p :ARG1 p) :mod (s / strange))
+        '''
+        out = StringIO()
+        self.write(out, alignments, tokens, compressed, indent)
+        return out.getvalue()
+
+    def write(self, out, alignments=True, tokens=True, compressed=False, indent=' '*4):
         '''
-        def alignment_str(align_key):
+        Write the Penman serialization to the stream out, see write_penman
+        '''
+        def alignment_str(align_key, span):
             s = '~' + align_key
             if tokens:  # alignment key is like "e.10" (single token offset) or "e.10,11" (multiple)
-                s += '[' + ','.join(tokens[int(woffset)] for woffset in align_key.split('.')[1].split(',')) + ']'
+                s += '[' + ','.join(tokens[woffset] for woffset in self._alignment_offsets[span[0]:span[1]]) + ']'
             return s
-        
-        s = ''
-        stack = []
-        instance_fulfilled = None
+
         align = role_align = {}
         if alignments:
+            self._build_alignments()
             if tokens:
                 tokens = self.tokens()
-            align = {k: alignment_str(align_key) for k,align_key in self._alignments.items()}
-            role_align = {k: alignment_str(align_key) for k,align_key in self._role_alignments.items()}
-        concept_stack_depth = {None: 0} # size of the stack when the :instance-of triple was encountered for the variable
-        for h, r, d in self.triples()+[(None,None,None)]:
-            align_key = align.get((h, r, d), '')
-            role_align_key = role_align.get((h, r, d), '')
-            if r==':top':
-                s += '(' + d()
-                stack.append((h, r, d))
-                instance_fulfilled = False
-            elif r==':instance-of':
-                s += ' / ' + d(align_key)
-                instance_fulfilled = True
-                concept_stack_depth[h] = len(stack)
-            elif h==stack[-1][2] and r==':polarity':   # polarity gets to be on the same line as the concept
-                s += ' ' + r + role_align_key + ' ' + d(align_key)
-            else:
-                while len(stack)>concept_stack_depth[h]:
-                    h2, r2, d2 = stack.pop()
-                    if instance_fulfilled is False:
-                        # just a variable or constant with no concept hanging off of it
-                        # so we have an extra paren to get rid of
-                        align_key2 = align.get((h2, r2, d2), '')
-                        s = s[:-len(d2(align_key2)) - 1] + d2(align_key2, append=not instance_fulfilled)
-                    else:
-                        s += ')'
-                    instance_fulfilled = None
-                if d is not None:
-                    s += '\n' + indent*len(stack) + r + role_align_key + ' (' + d(align_key)
-                    stack.append((h, r, d))
-                    instance_fulfilled = False
-        return s
+            align = {k: alignment_str(align_key, self._alignment_spans[k])
+                     for k,align_key in self._alignments.items()}
+            role_align = {k: alignment_str(align_key, self._role_alignment_spans[k])
+                          for k,align_key in self._role_alignments.items()}
+        write_penman(self.triples(), out, align, role_align, compressed, indent)
 
     def __repr__(self):
         return str(self)
@@ -506,7 +767,16 @@ class AMR(DependencyGraph):
         v2c = {}    # variable -> concept
         allvars = set() # all vars mentioned in the AMR
         elts = {}  # for interning variables, concepts, constants, etc.
-        consts = set()  # all constants used in the AMR
+        node_ops = []   # DependencyGraph node table operations, replayed by _build_nodes()
+        relations = self._relations
+
+        def intern_rel(label):
+            # one string object per relation label, with its attributes computed once
+            if label not in relations:
+                relations[label] = Relation(label)
+            return relations[label].label
+        alignment_list = []
+        role_alignment_list = []
 
         def intern_elt(x):
             return elts.setdefault(x, x)
@@ -527,19 +797,18 @@ class AMR(DependencyGraph):
                     concept_node, alignment_node = ch.children
                     c = intern_elt(Concept(concept_node.text))
                     v2c[v] = c
-                    self.add_node({'address': c, 'word': c, 'type': 'CONCEPT',
-                                   'rel': ':instance-of', 'head': v, 'deps': []})
+                    node_ops.append((c, 'CONCEPT', ':instance-of', v, []))
                     deps.append(c)
                     triple = (v, ':instance-of', c)
                     triples.append(triple)
                     if alignment_node.text:
-                        self._alignments[triple] = alignment_node.text[1:]
+                        alignment_list.append((triple, alignment_node.text[1:]))
                 elif t=='' and ch.children:
                     for ch2 in ch.children:
                         _part, RELpart, _part, Ypart = ch2.children
                         rel, relalignment = RELpart.children
-                        rel = rel.text
-                        assert rel is not None
+                        assert rel.text is not None
+                        rel = intern_rel(rel.text)
                         assert len(Ypart.children)==1
                         q = Ypart.children[0]
                         tq = q.expr_name
@@ -552,7 +821,6 @@ class AMR(DependencyGraph):
                         elif tq=='NAMEDCONST':
                             qleft, qalign = q.children
                             n2 = intern_elt(AMRConstant(qleft.text))
-                            consts.add(n2)
                         elif tq=='VAR':
                             qleft, qalign = q.children
                             n2 = intern_elt(Var(qleft.text))
@@ -560,22 +828,19 @@ class AMR(DependencyGraph):
                         elif tq=='STR':
                             quote1, qstr, quote2, qalign = q.children
                             n2 = intern_elt(AMRString(qstr.text))
-                            consts.add(n2)
                         elif tq=='NUM':
                             qleft, qalign = q.children
                             n2 = intern_elt(AMRNumber(qleft.text))
-                            consts.add(n2)
                         assert n2 is not None
-                        self.add_node({'address': n2, 'word': n2, 'type': tq,
-                                       'rel': rel, 'head': v})
-                        self.nodes[n2]['deps'].extend(deps2)
+                        node_ops.append((n2, tq, rel, v, None))
+                        node_ops.append((n2, None, None, None, deps2))
                         deps.append(n2)
                         triple = (v, rel, n2)
                         triples.append(triple)
                         if qalign and qalign.text:
-                            self._alignments[triple] = qalign.text[1:]
+                            alignment_list.append((triple, qalign.text[1:]))
                         if relalignment.text:
-                            self._role_alignments[triple] = relalignment.text[1:]
+                            role_alignment_list.append((triple, relalignment.text[1:]))
                         triples.extend(triples2)
             return v, triples, deps
 
@@ -586,9 +851,8 @@ class AMR(DependencyGraph):
             if ch.expr_name=='X':
                 assert n is None    # only one top-level node per AMR
                 n, triples, deps = walk(ch)
-                self.add_node({'address': n, 'word': n, 'type': 'VAR',
-                               'rel': ':top', 'head': intern_elt(Var('TOP'))})
-                self.nodes[n]['deps'].extend(deps)
+                node_ops.append((n, 'VAR', ':top', intern_elt(Var('TOP')), None))
+                node_ops.append((n, None, None, None, deps))
                 triples = [(intern_elt(Var('TOP')), ':top', n)] + triples
 
         if allvars - set(v2c.keys()):
@@ -597,7 +861,9 @@ class AMR(DependencyGraph):
         # All is well, so store the resulting data
         self._v2c = v2c
         self._triples = triples
-        self._constants = consts
+        self._node_ops = node_ops
+        self._alignment_list = alignment_list
+        self._role_alignment_list = role_alignment_list
 
 
 
@@ -1,10 +1,50 @@
 import re
 import pickle
 import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 from collections import defaultdict
 from amr_hackathon import amr
+from amr_lib.CMapMerger import DocumentCMapMerger
+from amr_lib.CMapGraph import CMapGraph
+from amr_lib.ConceptSalience import concept_keys
+from amr_lib.SubgraphHash import canonical_amr_hash
+from amr_lib.Backends import AsyncBackendStage
+from amr_lib.SpanAlignment import amr_triple_tokens, parse_openie_block, align_sentence, precision_recall
 from utils.PropBankReader import PropBankReader
 from utils.AmrReader import AMRReader
+from utils.SegmentStore import SegmentStore
+
+
+RE_FRAME = re.compile(r'(.*)-(\d*)$')
+
+
+def plain_triples(triples):
+    """
+    The triples with every variable and constant replaced by its name, so they hold no reference to the graph
+    """
+    return {str(key): (None if agent is None else str(agent), str(predicate), tuple(str(p) for p in patients))
+            for key, (agent, predicate, patients) in triples.items()}
+
+
+def select_amr_string_triples(triples, amr_string_table):
+    """
+    The amr_string_triples of triples, (agent, predicate concept, patient) amr strings for every patient, from
+    the amr_string_table of their sentence
+    """
+    if triples == {}:
+        return ''
+    results = []
+    for key, (agent, predicate, patients) in triples.items():
+        if key not in amr_string_table:
+            continue
+        result_0, result_1, results_2 = amr_string_table[key]
+        for concept_var in patients:
+            if concept_var:
+                results.append((result_0, result_1, results_2[concept_var]))
+    return results
 
 
 class AMRtoTriples:
@@ -12,176 +52,189 @@ class AMRtoTriples:
     def __init__(self, amr_data, propbank):
         self.amr_data = amr_data
         self.propbank = propbank
-        self.triples_linkers = None
+        self.predicate_args = None
+        self.agent_args = {}
         self.triples = {}
-        self.amr_obj = amr.AMR(self.amr_data['amr'], self.amr_data['tok'])
+        # the AMR may already have been parsed while loading the corpus
+        self.amr_obj = self.amr_data.get('amr_obj') or amr.AMR(self.amr_data['amr'], self.amr_data['tok'], lazy=True)
         self.var2c = self.amr_obj.var2concept()
 
+    def is_agent(self, n, concept):
+        """
+        Checking whether argument n of the predicate concept is an agent (denoted by 'pag') or not
+        """
+        if n is None:
+            return False
+        if concept not in self.agent_args:
+            self.agent_args[concept] = self.get_agent_args(concept)
+        return n in self.agent_args[concept]
+
+    def get_agent_args(self, concept):
+        """
+        The numbers of the agent arguments of a predicate concept, from its PropBank roleset
+        """
+        # TODO: beside 'pag' is there any other role?
+        m = RE_FRAME.match(concept)
+        key = m.group(1)
+        n = m.group(2)
+
+        # some annotation does not have the correspondence frameset, just put false if found
+        if n == '00':
+            return frozenset()
+
+        # Fixing some inconsistency in the annotation
+        if key + '.' + n not in self.propbank:
+            key = key.replace('-', '_')
+        roleset = self.propbank[key + '.' + n]
+        # a compact agent table (PropBankReader.agent_table) already holds the agent numbers
+        if isinstance(roleset, frozenset):
+            return roleset
+
+        roles = roleset.getElementsByTagName('role')
+        return frozenset(dict(role.attributes)['n'].value for role in roles
+                         if dict(role.attributes)['f'].value.lower() == 'pag')
 
     def convert(self) -> dict:
         """
-        Convert an AMR data to list of triples
+        Convert an AMR data to list of triples.
+        The ARG edges are grouped by predicate in a single pass over the role triples, so conversion
+        is linear in the number of edges.
         """
-        def get_triples_linker():
+        def get_predicate_args():
             """
-            Retrieve all of the triples linking phrases from the AMR object.
+            Retrieve the ARG and ARG-of edges of every predicate, in the order of the concepts.
             We use the Framenet words that are found in the AMR Object as the linker.
             """
-            triples_linkers = []
-            concepts = list(self.amr_obj.concepts())
-
-            # Retrieve all concept that has the word ARG in it
-            for concept in concepts:
-                triple = self.amr_obj.triples(head=concept[0])
-                items = [item for item in triple if 'ARG' in item[1]]
-                if len(items) > 0:
-                    triples_linkers.append(triple)
-            return triples_linkers
+            forward = {}
+            inverse = {}
+            relation = self.amr_obj.relation
+            for h, r, d in self.amr_obj.role_triples():
+                rel = relation(r)
+                if not rel.is_core:
+                    continue
+                if rel.is_inverse:
+                    inverse.setdefault(h, []).append((rel.arg_num, d))
+                else:
+                    forward.setdefault(h, []).append((rel.arg_num, d))
+            return [(v, forward.get(v, []), inverse.get(v, [])) for v in self.var2c
+                    if v in forward or v in inverse]
 
         def generate_triples():
-
-            def fixing_annotation(key, n):
-                """
-                Fixing some inconsistency in the annotation
-                """
-                if key + '.' + n not in self.propbank:
-                    key = key.replace('-', '_')
-                return key + '.' + n
-
-            def is_agent(f_rel, rel_var):
-                """
-                Checking whether the role is an agent (denoted by 'pag') or not
-                """
-                # TODO: beside 'pag' is there any other role?
-                m = re.match(r'(.*)-(\d*)$', rel_var)
-                key = m.group(1)
-                n = m.group(2)
-
-                # some annotation does not have the correspondence frameset, just put false if found
-                if n == '00':
-                    return False
-
-                concept = fixing_annotation(key, n)
-                roleset = self.propbank[concept]
-
-                m = re.match(r':ARG(.).*', f_rel[1])
-                n = int(m.group(1))
-                roles = roleset.getElementsByTagName('role')
-
-                for role in roles:
-                    if dict(role.attributes)['n'].value == str(n) and dict(role.attributes)['f'].value.lower() == 'pag':
-                        return True
-                return False
-
             # Case 1: ARG
-            for triple_linker in self.triples_linkers:
-                triple = [None, triple_linker[0][0], []]
-                for rel in triple_linker:
-                    if 'ARG' in rel[1] and 'of' not in rel[1]:
-                        # check whether the propbank verb rel[0] and its argument rel[2] is an agent or not
-                        if is_agent(rel, self.var2c[rel[0]].__str__()):
-                            triple[0] = rel[2]
-                        else:
-                            triple[2].append(rel[2])
+            for v, args, _ in self.predicate_args:
+                triple = [None, v, []]
+                concept = str(self.var2c[v])
+                for n, d in args:
+                    # check whether the propbank verb v and its argument d is an agent or not
+                    if self.is_agent(n, concept):
+                        triple[0] = d
+                    else:
+                        triple[2].append(d)
                 if not (triple[0] is None and triple[2] == []):
-                    self.triples[triple[1]] = triple
+                    self.triples[v] = triple
 
             # Case 2: ARG-of
-            for triple_linker in self.triples_linkers:
-                for rel in triple_linker:
-                    if 'ARG' in rel[1] and 'of' in rel[1]:
-                        if rel[2] not in self.triples:
-                            self.triples[rel[2]] = [None, rel[2], []]
-                        if is_agent(rel, self.var2c[rel[2]].__str__()):
-                            self.triples[rel[2]][0] = rel[0]
-                        else:
-                            self.triples[rel[2]][2].append(rel[0])
+            for v, _, inverse_args in self.predicate_args:
+                for n, d in inverse_args:
+                    if d not in self.triples:
+                        self.triples[d] = [None, d, []]
+                    if self.is_agent(n, str(self.var2c[d])):
+                        self.triples[d][0] = v
+                    else:
+                        self.triples[d][2].append(v)
             return self.triples
 
-        self.triples_linkers = get_triples_linker()
+        self.predicate_args = get_predicate_args()
         return generate_triples()
 
-    def generate_amr_string_from_triples(self):
+    def walk_subgraph(self, concept_var):
         """
-        Given a triple, generate an amr string from it
+        Yield the triples of the subgraph under a concept in Penman order, for write_penman
+        """
+        def get_triples(key):
+            result_triples = []
+            f_triples = self.amr_obj.triples(dep=key, rel=':ARG-of', normalize_inverses=True)
+            if f_triples:
+                result_triples.extend(f_triples)
+            f_triples = self.amr_obj.triples(head=key)
+            if f_triples:
+                result_triples.extend(f_triples)
+            return result_triples
+        entry = defaultdict(int)
+        q = []
+        q.append((amr.Var('TOP'), ':top', concept_var))
+        entry[concept_var] += 1
+        reentrancies = self.amr_obj.reentrancies()
+        while q:
+            u = q.pop()
+            yield u
+            triples = get_triples(u[2])
+            for triplet in triples[::-1]:
+                if triplet[2] in reentrancies:
+                    if entry[triplet[2]] <= reentrancies[triplet[2]] + 1:
+                        q.append(triplet)
+                        entry[triplet[2]] += 1
+                else:
+                    q.append(triplet)
+                    entry[triplet[2]] += 1
+
+    def write_amr_string(self, concept_var, out):
+        """
+        Write the amr string of a concept to out as single line Penman (as read by the AMR generator), streamed
+        while walking its subgraph
+        """
+        amr.write_penman(self.walk_subgraph(concept_var), out, compressed=True, skip=(':wiki',))
+
+    def amr_string(self, concept_var) -> str:
+        out = StringIO()
+        self.write_amr_string(concept_var, out)
+        return out.getvalue()
+
+    def amr_string_table(self):
+        """
+        The amr strings of the triples with an aligned predicate, by triple key: (agent amr string, predicate
+        concept, {patient: patient amr string}). The amr_string_triples of any part of the triples are then
+        selected without the graph, see select_amr_string_triples.
         """
         def get_alignment(f_concept_var):
             """
             Get alignment for a single concept
             """
-            for triplet, a in self.amr_obj.alignments().items():
-                if f_concept_var == triplet[0] and triplet[1] == ':instance-of':
-                    return int(a.split('.')[1].split(',')[0])
+            if f_concept_var not in self.var2c:
+                return None
+            offsets = self.amr_obj.alignment_offsets((f_concept_var, ':instance-of', self.var2c[f_concept_var]))
+            return offsets[0] if offsets else None
 
         def get_all_amr_string(f_concept_var):
             """
             Get all amr string from the concept
             """
-            def get_triples(key):
-                result_triples = []
-                f_triples = self.amr_obj.triples(dep=key, rel=':ARG-of', normalize_inverses=True)
-                if f_triples:
-                    result_triples.extend(f_triples)
-                f_triples = self.amr_obj.triples(head=key)
-                if f_triples:
-                    result_triples.extend(f_triples)
-                return result_triples
-            entry = defaultdict(int)
-            q = []
-            q.append((amr.Var('TOP'), ':top', f_concept_var))
-            entry[f_concept_var] += 1
-            reentrancies = self.amr_obj.reentrancies()
-            all_triples = []
-            while q:
-                u = q.pop()
-                all_triples.append(u)
-                triples = get_triples(u[2])
-                for triplet in triples[::-1]:
-                    if triplet[2] in reentrancies:
-                        if entry[triplet[2]] <= reentrancies[triplet[2]] + 1:
-                            q.append(triplet)
-                            entry[triplet[2]] += 1
-                    else:
-                        q.append(triplet)
-                        entry[triplet[2]] += 1
-            s = ''
-            stack = []
-            instance_fulfilled = None
-            align = role_align = {}
-            concept_stack_depth = {
-                None: 0}  # size of the stack when the :instance-of triple was encountered for the variable
-            for h, r, d in all_triples + [(None, None, None)]:
-                align_key = align.get((h, r, d), '')
-                role_align_key = role_align.get((h, r, d), '')
-                if r == ':top':
-                    s += '(' + d()
-                    stack.append((h, r, d))
-                    instance_fulfilled = False
-                elif r == ':instance-of':
-                    s += ' / ' + d(align_key)
-                    instance_fulfilled = True
-                    concept_stack_depth[h] = len(stack)
-                elif r == ':wiki':
-                    continue
-                elif h == stack[-1][2] and r == ':polarity':  # polarity gets to be on the same line as the concept
-                    s += ' ' + r + role_align_key + ' ' + d(align_key)
-                else:
-                    while len(stack) > concept_stack_depth[h]:
-                        h2, r2, d2 = stack.pop()
-                        if instance_fulfilled is False:
-                            # just a variable or constant with no concept hanging off of it
-                            # so we have an extra paren to get rid of
-                            align_key2 = align.get((h2, r2, d2), '')
-                            s = s[:-len(d2(align_key2)) - 1] + d2(align_key2, append=not instance_fulfilled)
-                        else:
-                            s += ')'
-                        instance_fulfilled = None
-                    if d is not None:
-                        s += ' \n' + ' ' * 4 * len(stack) + r + role_align_key + ' (' + d(align_key)
-                        stack.append((h, r, d))
-                        instance_fulfilled = False
-            return s
+            return self.amr_string(f_concept_var)
+
+        table = {}
+        for key, triple in self.triples.items():
+            result_1 = get_alignment(triple[1])
+            if result_1 is None:
+                continue
+            if triple[0] is not None:
+                result_0 = get_all_amr_string(triple[0])
+            else:
+                result_0 = ''
+            results_2 = {}
+            for concept_var in triple[2]:
+                if concept_var and concept_var not in results_2:
+                    result_2 = get_all_amr_string(concept_var)
+                    if len(result_2.split(' ')) == 1:
+                        if not result_2.startswith('('):
+                            result_2 = '(' + result_2 + ')'
+                    results_2[concept_var] = result_2
+            table[key] = (result_0, self.var2c[triple[1]]._name, results_2)
+        return table
 
+    def generate_amr_string_from_triples(self):
+        """
+        Given a triple, generate an amr string from it
+        """
         # def get_all_alignments(concept_var, sep, left=True):
         #     '''
         #     Get all alignments from the concept
@@ -282,25 +335,6 @@ class AMRtoTriples:
         #                 result_alignments.append(idx)
         #     return alignment_to_text(result_alignments)
 
-        if self.triples == {}:
-            return ''
-
-        results = []
-        for key, triple in self.triples.items():
-            result_1 = get_alignment(triple[1])
-            if result_1 is None:
-                continue
-            if triple[0] is not None:
-                result_0 = get_all_amr_string(triple[0])
-            else:
-                result_0 = ''
-            for concept_var in triple[2]:
-                if concept_var:
-                    result_2 = get_all_amr_string(concept_var)
-                    if len(result_2.split(' ')) == 1:
-                        if not result_2.startswith('('):
-                            result_2 = '(' + result_2 + ')'
-                    results.append((result_0, self.amr_obj.var2concept()[triple[1]]._name, result_2))
 
         # f = open('amr_string.txt', 'w')
         # for l, m, r in results:
@@ -309,79 +343,391 @@ class AMRtoTriples:
         #     if r != '':
         #         f.write(r+'\n')
         # f.close()
-        return results
+        return select_amr_string_triples(self.triples, self.amr_string_table())
 
 
 class AMRCorpusExtConverter:
     """
     Read the amr corpus and update the amr with triples
     """
-    def __init__(self, c_amr_corpus, c_propbank_data, output_path):
+    def __init__(self, c_amr_corpus, c_propbank_data, output_path, memo=None, low_memory=False, threads=1):
         self.amr_corpus = c_amr_corpus
         self.propbank_data = c_propbank_data
         self.output_path = os.path.join(output_path, 'data')
-
-    def update_amr_corpus_with_triples(self):
+        self.cmaps = {}
+        # optional TriplesMemo, reusing the results of duplicate sentences
+        self.memo = memo
+        # in low memory mode the corpus only keeps plain string triples, no graph objects
+        self.low_memory = low_memory
+        # number of threads converting the sentences
+        self.threads = threads
+        # amr_corpus_ext.pickle, with the segments of appended documents
+        self.store = SegmentStore(self.output_path, 'amr_corpus_ext')
+
+    def iter_sentences(self):
         for dataset_name, dataset in self.amr_corpus.items():
             for doc_name, doc in dataset.items():
                 for amr_id, amr_data in doc.items():
-                    amr_to_triples = AMRtoTriples(amr_data, self.propbank_data)
-                    self.amr_corpus[dataset_name][doc_name][amr_id]['triples'] = amr_to_triples.convert()
-                    self.amr_corpus[dataset_name][doc_name][amr_id]['amr_string_triples'] \
-                        = amr_to_triples.generate_amr_string_from_triples()
+                    yield dataset_name, doc_name, amr_id, amr_data
+
+    def map_sentences(self, func, items):
+        """
+        Apply func to every item, in a pool of threads when the converter has more than one, yielding the
+        results in order. AMR parsing and AMRtoTriples share no mutable state, so sentences convert in parallel
+        on the same corpus and propbank without pickling them to worker processes.
+        """
+        if self.threads > 1:
+            with ThreadPoolExecutor(self.threads) as pool:
+                yield from pool.map(func, items)
+        else:
+            yield from map(func, items)
+
+    @staticmethod
+    def sentence_graph(amr_data):
+        """
+        The parsed AMR of a sentence, the one parsed while loading the corpus if there is one
+        """
+        return amr_data.get('amr_obj') or amr.AMR(amr_data['amr'], amr_data['tok'], lazy=True)
+
+    def convert_sentence(self, amr_data, keep_graph=False):
+        """
+        The (triples, amr_string_triples, amr_obj) of a sentence, the parsed AMR is only returned with keep_graph
+        """
+        amr_to_triples = AMRtoTriples(amr_data, self.propbank_data)
+        triples = amr_to_triples.convert()
+        amr_string_triples = amr_to_triples.generate_amr_string_from_triples()
+        return (plain_triples(triples) if self.low_memory else triples, amr_string_triples,
+                amr_to_triples.amr_obj if keep_graph else None)
+
+    def update_amr_corpus_with_triples(self, exporter=None, salience=None, index=None):
+        """
+        Convert every sentence of the corpus, streaming each converted sentence to the exporter and adding it to
+        the TriplesIndex if they are given.
+        With a ConceptSalience, the triples are pruned to the salient concepts of their document first.
+        """
+        if salience is not None:
+            return self.update_amr_corpus_with_salient_triples(salience, exporter, index)
+        # the graph parsed by the conversion is passed on to the index and the exporter, memoized sentences are
+        # parsed for them
+        keep_graph = index is not None or exporter is not None
+        sentences = self.iter_sentences()
+        if self.threads > 1:
+            # the memo is only used from this thread: every sentence is looked up before the pool converts the
+            # misses, so duplicates within one run are converted again
+            sentences = list(sentences)
+            cached = [self.memo.get(sentence[3]) if self.memo is not None else None for sentence in sentences]
+            results = self.map_sentences(
+                lambda item: item[1] + (None,) if item[1] else self.convert_sentence(item[0][3], keep_graph),
+                zip(sentences, cached))
+        else:
+            cached = results = None
+        for n, (dataset_name, doc_name, amr_id, amr_data) in enumerate(sentences):
+            if results is not None:
+                result = next(results)
+                is_new = cached[n] is None
+            else:
+                result = self.memo.get(amr_data) if self.memo is not None else None
+                is_new = result is None
+                result = self.convert_sentence(amr_data, keep_graph) if is_new else result + (None,)
+            if is_new and self.memo is not None:
+                self.memo.put(amr_data, *result[:2])
+            amr_data['triples'], amr_data['amr_string_triples'], amr_obj = result
+            if keep_graph and amr_obj is None:
+                amr_obj = self.sentence_graph(amr_data)
+            if index is not None:
+                index.write(dataset_name, doc_name, amr_id, amr_data, amr_obj)
+            if exporter is not None:
+                exporter.write(dataset_name, doc_name, amr_id, amr_data, amr_obj)
+            amr_data.pop('amr_obj', None)
+        return self.amr_corpus
+
+    def update_amr_corpus_with_salient_triples(self, salience, exporter=None, index=None):
+        """
+        Convert every sentence in two passes: the triples of the whole corpus are converted and their concepts
+        scored by document, then the triples of every sentence are pruned to the top-k concepts of its document
+        and the AMR strings are only kept for what is left. The memo is not used, the pruned results
+        depend on the document. The scores are saved to concept_salience.pickle.
+        No graph is kept between the passes: the first one keeps the amr strings of every triple of a sentence
+        (see AMRtoTriples.amr_string_table), and those of the pruned triples are selected from them. The AMRs
+        are only parsed again for the index and the exporter.
+        """
+        def convert(sentence):
+            amr_to_triples = AMRtoTriples(sentence[3], self.propbank_data)
+            triples = amr_to_triples.convert()
+            return triples, concept_keys(amr_to_triples.amr_obj, triples), amr_to_triples.amr_string_table()
+
+        sentences = list(self.iter_sentences())
+        amr_string_tables = []
+        sentence_keys = []
+        for (dataset_name, doc_name, amr_id, amr_data), (triples, keys, amr_string_table) in zip(
+                sentences, self.map_sentences(convert, sentences)):
+            amr_data['triples'] = triples
+            amr_string_tables.append(amr_string_table)
+            sentence_keys.append(keys)
+            salience.add_sentence((dataset_name, doc_name), keys)
+        salient = salience.fit()
+        pruned = [salience.prune_triples(sentence[3]['triples'], keys, salient[sentence[:2]])
+                  for sentence, keys in zip(sentences, sentence_keys)]
+        del sentence_keys
+        for (dataset_name, doc_name, amr_id, amr_data), triples, amr_string_table in zip(
+                sentences, pruned, amr_string_tables):
+            amr_data['amr_string_triples'] = select_amr_string_triples(triples, amr_string_table)
+            amr_data['triples'] = plain_triples(triples) if self.low_memory else triples
+            amr_obj = self.sentence_graph(amr_data) if index is not None or exporter is not None else None
+            if index is not None:
+                index.write(dataset_name, doc_name, amr_id, amr_data, amr_obj)
+            if exporter is not None:
+                exporter.write(dataset_name, doc_name, amr_id, amr_data, amr_obj)
+            amr_data.pop('amr_obj', None)
+        output_file = open(os.path.join(self.output_path, 'concept_salience.pickle'), 'wb')
+        pickle.dump(salience.to_dict(), output_file, -1)
+        output_file.close()
         return self.amr_corpus
 
+    def export_triples(self, exporter):
+        """
+        Export (or index) the triples of an already converted corpus
+        """
+        for dataset_name, dataset in self.amr_corpus.items():
+            for doc_name, doc in dataset.items():
+                for amr_id, amr_data in doc.items():
+                    exporter.write(dataset_name, doc_name, amr_id, amr_data, self.sentence_graph(amr_data))
+
+    def merge_document_cmaps(self, merge_unnamed=False):
+        """
+        Merge the sentence triples of every document into one concept map per document
+        """
+        self.cmaps = {}
+        for dataset_name, dataset in self.amr_corpus.items():
+            dataset_cmaps = self.cmaps.setdefault(dataset_name, {})
+            for doc_name, doc in dataset.items():
+                merger = DocumentCMapMerger(merge_unnamed)
+                for amr_id, amr_data in doc.items():
+                    if not amr_data['triples']:
+                        continue
+                    amr_obj = amr.AMR(amr_data['amr'], amr_data['tok'], lazy=True)
+                    merger.add_sentence(doc_name + '.' + amr_id, amr_obj, amr_data['triples'])
+                dataset_cmaps[doc_name] = merger.cmap()
+        return self.cmaps
+
+    def save_cmaps(self):
+        output_file = open(os.path.join(self.output_path, 'amr_cmaps.pickle'), 'wb')
+        pickle.dump(self.cmaps, output_file, -1)
+
+    def load_cmaps(self):
+        infile = open(os.path.join(self.output_path, 'amr_cmaps.pickle'), 'rb')
+        self.cmaps = pickle.load(infile)
+        return self.cmaps
+
+    def export_cmap_graphs(self, formats=()):
+        """
+        Turn the merged concept map of every document into its sparse graph with degree, PageRank salience
+        and connected components, saved to cmap_graphs.pickle. Formats ('graphml', 'edgelist') also writes
+        every graph to cmap_graphs/<dataset>/<document>.<format>.
+        """
+        graphs = {}
+        for dataset_name, dataset_cmaps in self.cmaps.items():
+            dir_path = os.path.join(self.output_path, 'cmap_graphs', dataset_name)
+            if formats and not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            dataset_graphs = graphs.setdefault(dataset_name, {})
+            for doc_name, cmap in dataset_cmaps.items():
+                graph = CMapGraph(cmap)
+                salience = graph.pagerank()
+                in_degree, out_degree = graph.degree()
+                dataset_graphs[doc_name] = dict(graph.to_dict(), salience=salience, in_degree=in_degree,
+                                                out_degree=out_degree, components=graph.components())
+                if 'graphml' in formats:
+                    graph.write_graphml(os.path.join(dir_path, doc_name + '.graphml'), salience)
+                if 'edgelist' in formats:
+                    graph.write_edge_list(os.path.join(dir_path, doc_name + '.tsv'))
+        output_file = open(os.path.join(self.output_path, 'cmap_graphs.pickle'), 'wb')
+        pickle.dump(graphs, output_file, -1)
+        output_file.close()
+        return graphs
+
     def write_tok_to_file(self):
         """
-        Write tok to file, for openIE relation extraction later
+        Write tok to file, for openIE relation extraction later, returns the token files
         """
         dir_path = os.path.join(self.output_path, 'tokens')
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
+        paths = []
         for dataset_name, dataset in self.amr_corpus.items():
-            f = open(os.path.join(dir_path, dataset_name + '_tok.txt'), 'w')
+            paths.append(os.path.join(dir_path, dataset_name + '_tok.txt'))
+            f = open(paths[-1], 'w')
             for doc_name, doc in dataset.items():
                 for amr_id, amr_data in doc.items():
-                    amr_strings = self.amr_corpus[dataset_name][doc_name][amr_id]['amr_string_triples']
-                    if not amr_strings:
+                    if not amr_data['amr_string_triples']:
                         continue
-                    tok = ' '.join(self.amr_corpus[dataset_name][doc_name][amr_id]['tok'])
-                    f.write(tok + '\n')
+                    f.write(' '.join(amr_data['tok']) + '\n')
             f.close()
+        return paths
 
-    def write_amr_string_to_file(self):
+    def write_amr_string_to_file(self, dedup=False):
         """
-        Write amr_string from each triple to file, for use by AMR generation
+        Write amr_string from each triple to file, for use by AMR generation. The amr_strings are written
+        on a single line each (see AMRtoTriples.write_amr_string), one graph per line as read by the generator.
+        With dedup, subgraphs that only differ in variable names are written once and a mapping file
+        records, for every amr_string in the original order, the line of its unique string.
         """
         dir_path = os.path.join(self.output_path, 'amr_string')
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
         for dataset_name, dataset in self.amr_corpus.items():
             f = open(os.path.join(dir_path, dataset_name + '_amr_string.txt'), 'w')
+            f_map = open(os.path.join(dir_path, dataset_name + '_amr_string.map'), 'w') if dedup else None
+            unique_ids = {}
             for doc_name, doc in dataset.items():
                 for amr_id, amr_data in doc.items():
-                    amr_strings = self.amr_corpus[dataset_name][doc_name][amr_id]['amr_string_triples']
-                    for left, middle, right in amr_strings:
-                        if left != '':
-                            f.write(left+'\n')
-                        if right != '':
-                            f.write(right+'\n')
+                    for left, middle, right in amr_data['amr_string_triples']:
+                        for amr_string in (left, right):
+                            if amr_string == '':
+                                continue
+                            if not dedup:
+                                f.write(amr_string + '\n')
+                                continue
+                            key = canonical_amr_hash(amr_string)
+                            if key not in unique_ids:
+                                unique_ids[key] = len(unique_ids)
+                                f.write(amr_string + '\n')
+                            f_map.write(str(unique_ids[key]) + '\n')
+            f.close()
+            if f_map:
+                f_map.close()
+
+    def expand_amr_string_results(self, dataset_name, results):
+        """
+        Expand the generator results of a deduplicated amr_string file back to one result per amr_string
+        """
+        map_file = open(os.path.join(self.output_path, 'amr_string', dataset_name + '_amr_string.map'))
+        expanded = [results[int(line)] for line in map_file]
+        map_file.close()
+        return expanded
+
+    def iter_amr_strings(self, dataset_name):
+        """
+        All amr_strings of a dataset, in the order they are written by write_amr_string_to_file
+        """
+        for doc_name, doc in self.amr_corpus[dataset_name].items():
+            for amr_id, amr_data in doc.items():
+                for left, middle, right in amr_data['amr_string_triples']:
+                    if left != '':
+                        yield left
+                    if right != '':
+                        yield right
+
+    def iter_tok(self, dataset_name):
+        """
+        All token lines of a dataset, in the order they are written by write_tok_to_file
+        """
+        for doc_name, doc in self.amr_corpus[dataset_name].items():
+            for amr_id, amr_data in doc.items():
+                if not amr_data['amr_string_triples']:
+                    continue
+                yield ' '.join(amr_data['tok'])
+
+    def run_backends(self, generator_backend, openie_backend, concurrency=4, batch_size=32):
+        """
+        Stream the amr_strings and token lines of every dataset to the AMR generator and OpenIE back-ends,
+        writing <dataset>_generated.txt and <dataset>_openie.txt in the formats read by write_triples_to_files
+        """
+        amr_string_path = os.path.join(self.output_path, 'amr_string')
+        tok_path = os.path.join(self.output_path, 'tokens')
+        for dir_path in (amr_string_path, tok_path):
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+        generator_stage = AsyncBackendStage(generator_backend, concurrency, batch_size, key=canonical_amr_hash)
+        openie_stage = AsyncBackendStage(openie_backend, concurrency, batch_size)
+
+        async def run_dataset(dataset_name):
+            f = open(os.path.join(amr_string_path, dataset_name + '_generated.txt'), 'w')
+            f_openie = open(os.path.join(tok_path, dataset_name + '_openie.txt'), 'w')
+
+            async def generate():
+                async for text in generator_stage.stream(self.iter_amr_strings(dataset_name)):
+                    f.write(' '.join(text.split()) + '\n')
+
+            async def extract():
+                async for extractions in openie_stage.stream(self.iter_tok(dataset_name)):
+                    for line in extractions:
+                        f_openie.write(line + '\n')
+                    f_openie.write('\n')
+
+            await asyncio.gather(generate(), extract())
             f.close()
+            f_openie.close()
 
-    def write_triples_to_files(self):
+        for dataset_name in self.amr_corpus.keys():
+            asyncio.run(run_dataset(dataset_name))
+        return {'generator': (generator_stage.hits, generator_stage.misses),
+                'openie': (openie_stage.hits, openie_stage.misses)}
+
+    def align_openie(self, openie_output=None):
+        """
+        Join the triples of every sentence with its OpenIE extractions through their token spans, in one pass
+        over each dataset. Writes the matches of every sentence to alignment/<dataset>_openie.jsonl and returns
+        the (precision, recall) of the extractions against the AMR triples per dataset.
+        """
+        dir_path = os.path.join(self.output_path, 'alignment')
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        scores = {}
         for dataset_name, dataset in self.amr_corpus.items():
-            if dataset_name != 'dev':
+            openie_file = openie_output or os.path.join(self.output_path, 'tokens', dataset_name + '_openie.txt')
+            if not os.path.isfile(openie_file):
                 continue
-            f = open('/home/acp16hh/Projects/Research/Exp_7_Improve_CMap/lib/amr2eng/sample/sample.out', 'r')
-            f_openie = open('/home/acp16hh/Projects/Research/Exp_7_Improve_CMap/lib/openie-standalone/openie_dev.out', 'r')
+            f_openie = open(openie_file, 'r')
+            f_out = open(os.path.join(dir_path, dataset_name + '_openie.jsonl'), 'w')
+            totals = [0, 0, 0, 0]
+            for doc_name, doc in dataset.items():
+                for amr_id, amr_data in doc.items():
+                    if not amr_data['amr_string_triples']:
+                        continue
+                    # the OpenIE output has a block of lines per sentence written by write_tok_to_file
+                    block = []
+                    for line in f_openie:
+                        if line == '\n':
+                            break
+                        block.append(line.rstrip('\n'))
+                    triple_tokens = amr_triple_tokens(amr_data)
+                    extractions = parse_openie_block(block, amr_data['tok'])
+                    pairs = align_sentence(triple_tokens, extractions)
+                    counts = [len(triple_tokens), len(extractions),
+                              len(set(t for t, _ in pairs)), len(set(n for _, n in pairs))]
+                    totals = [total + count for total, count in zip(totals, counts)]
+                    f_out.write(json.dumps({'id': doc_name + '.' + amr_id, 'amr_triples': counts[0],
+                                            'openie_triples': counts[1], 'pairs': pairs}) + '\n')
+            f_openie.close()
+            f_out.close()
+            scores[dataset_name] = precision_recall(*totals)
+        return scores
+
+    def write_triples_to_files(self, dedup=False, generator_output=None, openie_output=None):
+        """
+        Write the triples of each sentence next to their generated text and OpenIE triples.
+        The back-end outputs default to the files written by run_backends, datasets without them are skipped.
+        """
+        for dataset_name, dataset in self.amr_corpus.items():
+            generator_file = generator_output or os.path.join(self.output_path, 'amr_string',
+                                                              dataset_name + '_generated.txt')
+            openie_file = openie_output or os.path.join(self.output_path, 'tokens', dataset_name + '_openie.txt')
+            if not (os.path.isfile(generator_file) and os.path.isfile(openie_file)):
+                continue
+            f = open(generator_file, 'r')
+            f_openie = open(openie_file, 'r')
             f_out = open(dataset_name + '_out.txt', 'w')
             openie_content = f_openie.readlines()
             content = f.readlines()
+            if dedup:
+                # the generator was run on the deduplicated amr_string file
+                content = self.expand_amr_string_results(dataset_name, content)
             idx = 0
             idx_openie = 0
             for doc_name, doc in dataset.items():
                 for id, amr_data in doc.items():
-                    amr_strings = self.amr_corpus[dataset_name][doc_name][id]['cmaps_text']
+                    amr_strings = self.amr_corpus[dataset_name][doc_name][id]['amr_string_triples']
                     if not amr_strings:
                         continue
                     tok = ' '.join(self.amr_corpus[dataset_name][doc_name][id]['tok'])
@@ -428,12 +774,16 @@ class AMRCorpusExtConverter:
         return os.path.isfile(os.path.join(self.output_path, 'amr_corpus_ext.pickle'))
 
     def save_data(self):
-        output_file = open(os.path.join(self.output_path, 'amr_corpus_ext.pickle'), 'wb')
-        pickle.dump(self.amr_corpus, output_file, -1)
+        self.store.save(self.amr_corpus)
+
+    def append_data(self):
+        """
+        Append the converted documents of this converter to the stored corpus, as a new segment
+        """
+        self.store.append(self.amr_corpus)
 
     def load_data(self):
-        infile = open(os.path.join(self.output_path, 'amr_corpus_ext.pickle'), 'rb')
-        self.amr_corpus = pickle.load(infile)
+        self.amr_corpus = self.store.load()
         return self.amr_corpus
 
 
@@ -0,0 +1,83 @@
+"""
+Vectorized projection of AMR subgraphs onto the sentence tokens they are aligned to.
+The alignments of a graph are packed once into NumPy arrays (the head variable of every aligned
+triple and its token offsets in CSR layout), so projecting a subgraph is a reachability walk
+followed by array selections.
+"""
+import numpy as np
+from amr_hackathon import amr
+
+
+class AlignmentIndex:
+
+    def __init__(self, amr_obj):
+        self.amr_obj = amr_obj
+        self.var_ids = {v: i for i, v in enumerate(amr_obj.var2concept())}
+        # children of every variable, following the triples in the direction they are annotated
+        self.children = [[] for _ in self.var_ids]
+        for h, r, d in amr_obj.role_triples():
+            if isinstance(d, amr.Var) and d in self.var_ids and h in self.var_ids:
+                self.children[self.var_ids[h]].append(self.var_ids[d])
+
+        heads = []
+        indptr = [0]
+        offsets = []
+        alignments = list(amr_obj.alignments().keys())
+        role_alignments = list(amr_obj.role_alignments().keys())
+        for role, triples in ((False, alignments), (True, role_alignments)):
+            for triple in triples:
+                if triple[0] not in self.var_ids:
+                    continue
+                heads.append(self.var_ids[triple[0]])
+                offsets.extend(amr_obj.alignment_offsets(triple, role=role))
+                indptr.append(len(offsets))
+        self.heads = np.array(heads, dtype=np.int32)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.offsets = np.array(offsets, dtype=np.int32)
+
+    def reachable(self, var):
+        """
+        Ids of the variables of the subgraph rooted at var
+        """
+        start = self.var_ids[var]
+        seen = np.zeros(len(self.var_ids), dtype=bool)
+        seen[start] = True
+        stack = [start]
+        while stack:
+            for child in self.children[stack.pop()]:
+                if not seen[child]:
+                    seen[child] = True
+                    stack.append(child)
+        return seen
+
+    def subgraph_tokens(self, var) -> np.ndarray:
+        """
+        Sorted unique token offsets covered by the subgraph rooted at var, including role alignments
+        """
+        if len(self.heads) == 0:
+            return np.empty(0, dtype=np.int32)
+        selected = np.flatnonzero(self.reachable(var)[self.heads])
+        starts = self.indptr[selected]
+        lengths = self.indptr[selected + 1] - starts
+        # gather the CSR rows of the selected triples in one go
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.unique(self.offsets[positions])
+
+    def subgraph_spans(self, var) -> np.ndarray:
+        """
+        Token spans covered by the subgraph rooted at var, as an (n, 2) array of [start, end) offsets
+        """
+        return self.token_spans(self.subgraph_tokens(var))
+
+    @staticmethod
+    def token_spans(tokens, tolerance=1) -> np.ndarray:
+        """
+        Group sorted token offsets into contiguous [start, end) spans; offsets at most tolerance apart
+        are considered contiguous
+        """
+        if len(tokens) == 0:
+            return np.empty((0, 2), dtype=np.int32)
+        breaks = np.flatnonzero(np.diff(tokens) > tolerance) + 1
+        starts = tokens[np.concatenate(([0], breaks))]
+        ends = tokens[np.concatenate((breaks - 1, [len(tokens) - 1]))] + 1
+        return np.stack((starts, ends), axis=1).astype(np.int32)
@@ -0,0 +1,209 @@
+"""
+Asynchronous client stage for the AMR-to-text generator and OpenIE back-ends.
+Inputs are streamed to a back-end in batches by a bounded number of concurrent workers; a window of
+in-flight batches gives backpressure on the producer and results come back in input order.
+Back-ends are pluggable: anything implementing Backend.run_batch can be used, a shell command
+wrapper and local stubs (for running the pipeline end to end without the real tools) are included.
+"""
+import re
+import asyncio
+from abc import ABC, abstractmethod
+
+RE_TOKEN = re.compile(r'"[^"]*"|[^\s()]+')
+RE_SENSE = re.compile(r'-\d\d$')
+
+
+class Backend(ABC):
+    """
+    A back-end receives a batch of inputs and returns one result per input
+    """
+    @abstractmethod
+    async def run_batch(self, items: list) -> list:
+        pass
+
+
+class SubprocessBackend(Backend):
+    """
+    Run a shell command once per batch, feeding the inputs one per line (whitespace normalized) on stdin.
+    The command either prints one line per input, or with block_output a block of lines per input
+    separated by empty lines (the OpenIE format).
+    """
+    def __init__(self, command, block_output=False):
+        self.command = command
+        self.block_output = block_output
+
+    async def run_batch(self, items: list) -> list:
+        proc = await asyncio.create_subprocess_shell(self.command, stdin=asyncio.subprocess.PIPE,
+                                                     stdout=asyncio.subprocess.PIPE)
+        lines = [' '.join(item.split()) for item in items]
+        stdout, _ = await proc.communicate(('\n'.join(lines) + '\n').encode('utf-8'))
+        if proc.returncode != 0:
+            raise RuntimeError('Back-end command failed: ' + self.command)
+        lines = stdout.decode('utf-8').split('\n')
+        if self.block_output:
+            results = []
+            block = []
+            for line in lines:
+                if line == '':
+                    if block:
+                        results.append(block)
+                        block = []
+                    continue
+                block.append(line)
+            if block:
+                results.append(block)
+        else:
+            results = [line for line in lines if line != '']
+        if len(results) != len(items):
+            raise RuntimeError('Back-end returned ' + str(len(results)) + ' results for '
+                               + str(len(items)) + ' inputs')
+        return results
+
+
+class StubGeneratorBackend(Backend):
+    """
+    Local stand-in for the AMR generator: verbalizes a subgraph as its names and concepts in order
+    """
+    async def run_batch(self, items: list) -> list:
+        results = []
+        for amr_string in items:
+            tokens = RE_TOKEN.findall(amr_string)
+            words = []
+            for i, token in enumerate(tokens):
+                if token.startswith('"'):
+                    words.append(token.strip('"'))
+                elif i > 0 and tokens[i - 1] == '/' and token != 'name':
+                    words.append(RE_SENSE.sub('', token))
+            results.append(' '.join(words).lower())
+        return results
+
+
+class StubOpenIEBackend(Backend):
+    """
+    Local stand-in for OpenIE: one extraction per sentence, in the openie-standalone output format,
+    with the sentence split in three parts
+    """
+    async def run_batch(self, items: list) -> list:
+        results = []
+        for sentence in items:
+            tokens = sentence.split()
+            extractions = [sentence]
+            if len(tokens) >= 3:
+                third = len(tokens) // 3
+                args = (tokens[:third], tokens[third:2 * third], tokens[2 * third:])
+                extractions.append('1.00 (' + '; '.join(' '.join(arg) for arg in args) + ')')
+            results.append(extractions)
+        return results
+
+
+class AsyncBackendStage:
+    """
+    Stream inputs through a back-end with bounded concurrency, batching, backpressure and a result cache
+    """
+    def __init__(self, backend, concurrency=4, batch_size=32, max_pending=16, key=None):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        # maximum number of batches that are queued, running or waiting to be consumed
+        self.max_pending = max_pending
+        # key maps an input to its cache key, e.g. a canonical hash for AMR strings
+        self.key = key if key is not None else (lambda x: x)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def run_batch(self, batch):
+        keys = [self.key(item) for item in batch]
+        todo = {}
+        for k, item in zip(keys, batch):
+            if k in self.cache:
+                self.hits += 1
+            elif k not in todo:
+                self.misses += 1
+                todo[k] = item
+            else:
+                self.hits += 1
+        if todo:
+            results = await self.backend.run_batch(list(todo.values()))
+            for k, result in zip(todo.keys(), results):
+                self.cache[k] = result
+        return [self.cache[k] for k in keys]
+
+    async def stream(self, items):
+        """
+        Asynchronously yield the result of every input, in input order
+        """
+        queue = asyncio.Queue()
+        window = asyncio.Semaphore(self.max_pending)
+        cond = asyncio.Condition()
+        done = {}
+        errors = []
+        total = [None]
+
+        async def produce():
+            n = 0
+            batch = []
+            try:
+                for item in items:
+                    batch.append(item)
+                    if len(batch) == self.batch_size:
+                        await window.acquire()
+                        await queue.put((n, batch))
+                        n += 1
+                        batch = []
+                if batch:
+                    await window.acquire()
+                    await queue.put((n, batch))
+                    n += 1
+            except Exception as e:
+                async with cond:
+                    errors.append(e)
+                    cond.notify_all()
+                return
+            for _ in range(self.concurrency):
+                await queue.put(None)
+            async with cond:
+                total[0] = n
+                cond.notify_all()
+
+        async def work():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                n, batch = job
+                try:
+                    results = await self.run_batch(batch)
+                except Exception as e:
+                    async with cond:
+                        errors.append(e)
+                        cond.notify_all()
+                    return
+                async with cond:
+                    done[n] = results
+                    cond.notify_all()
+
+        tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(work()) for _ in range(self.concurrency)]
+        try:
+            n = 0
+            while True:
+                async with cond:
+                    await cond.wait_for(lambda: errors or n in done or (total[0] is not None and n >= total[0]))
+                    if errors:
+                        raise errors[0]
+                    if n not in done:
+                        break
+                    results = done.pop(n)
+                window.release()
+                n += 1
+                for result in results:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(self, items) -> list:
+        return [result async for result in self.stream(items)]
+
+    def run_sync(self, items) -> list:
+        return asyncio.run(self.run(items))
@@ -0,0 +1,145 @@
+"""
+Sparse matrix form of the document concept maps built by DocumentCMapMerger, with vectorized analytics
+for selecting summary content, and GraphML / edge list writers.
+Nodes are the cmap nodes, concepts and relations (the predicate labels) are numbered in id tables, and
+the edges from an agent to a patient make up a CSR adjacency weighted by their number of mentions.
+Edges without an agent have no source node and edges without a patient no target node: they are kept in
+the edge table with source (or target) -1, and count towards the degree of the node they have.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from xml.sax.saxutils import escape
+
+
+class CMapGraph:
+
+    def __init__(self, cmap):
+        self.names = [node['name'] for node in cmap['nodes']]
+        concept_ids = {}
+        relation_ids = {}
+        self.node_concepts = np.array([concept_ids.setdefault(node['concept'], len(concept_ids))
+                                       for node in cmap['nodes']], dtype=np.int32)
+        self.concepts = list(concept_ids)
+        edges = cmap['edges']
+        self.sources = np.array([-1 if e['source'] is None else e['source'] for e in edges], dtype=np.int32)
+        self.targets = np.array([-1 if e['target'] is None else e['target'] for e in edges], dtype=np.int32)
+        self.edge_relations = np.array([relation_ids.setdefault(e['label'], len(relation_ids)) for e in edges],
+                                       dtype=np.int32)
+        self.relations = list(relation_ids)
+        self.edge_weights = np.array([len(e['mentions']) for e in edges], dtype=np.float64)
+        self.mentions = np.array([len(node['mentions']) for node in cmap['nodes']], dtype=np.float64)
+        n = len(self.node_concepts)
+        attached = (self.sources >= 0) & (self.targets >= 0)
+        # duplicate (source, target) pairs of different relations are summed
+        self.adjacency = sparse.csr_matrix((self.edge_weights[attached],
+                                            (self.sources[attached], self.targets[attached])), shape=(n, n))
+
+    def __len__(self):
+        return len(self.node_concepts)
+
+    def degree(self):
+        """
+        Weighted (in, out) degree of every node; edges without an agent count towards the in degree of their
+        target, edges without a patient towards the out degree of their source
+        """
+        in_degree = np.asarray(self.adjacency.sum(axis=0)).ravel()
+        in_degree += np.bincount(self.targets[self.sources < 0], weights=self.edge_weights[self.sources < 0],
+                                 minlength=len(self))
+        out_degree = np.asarray(self.adjacency.sum(axis=1)).ravel()
+        out_degree += np.bincount(self.sources[self.targets < 0], weights=self.edge_weights[self.targets < 0],
+                                  minlength=len(self))
+        return in_degree, out_degree
+
+    def pagerank(self, damping=0.85, directed=True, tol=1e-8, max_iter=100):
+        """
+        PageRank salience of the nodes by power iteration, teleporting in proportion to the node mentions
+        (so nodes that are only reached by edges without an agent still get their share)
+        """
+        n = len(self)
+        if n == 0:
+            return np.empty(0)
+        adjacency = self.adjacency if directed else self.adjacency + self.adjacency.T
+        out_weight = np.asarray(adjacency.sum(axis=1)).ravel()
+        dangling = out_weight == 0
+        scale = np.divide(1.0, out_weight, out=np.zeros(n), where=~dangling)
+        transition = sparse.diags(scale) @ adjacency
+        teleport = self.mentions / self.mentions.sum() if self.mentions.sum() else np.full(n, 1.0 / n)
+        rank = teleport.copy()
+        for _ in range(max_iter):
+            new_rank = damping * (transition.T @ rank + rank[dangling].sum() * teleport) + (1 - damping) * teleport
+            if np.abs(new_rank - rank).sum() < tol:
+                return new_rank
+            rank = new_rank
+        return rank
+
+    def components(self):
+        """
+        Weakly connected component label of every node
+        """
+        return connected_components(self.adjacency, directed=True, connection='weak')[1]
+
+    def salient_nodes(self, k=10, **kwargs):
+        """
+        Ids of the k nodes with the highest PageRank salience, most salient first
+        """
+        rank = self.pagerank(**kwargs)
+        k = min(k, len(rank))
+        top = np.argpartition(-rank, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        return top[np.argsort(-rank[top], kind='stable')]
+
+    def node_label(self, node_id):
+        name = self.names[node_id]
+        concept = self.concepts[self.node_concepts[node_id]]
+        return concept if name is None else concept + ' "' + name + '"'
+
+    def write_edge_list(self, path):
+        """
+        Tab separated source, relation, target and weight of every edge, with node labels; the source of an
+        edge without an agent, and the target of an edge without a patient, is empty
+        """
+        f = open(path, 'w')
+        for s, r, t, w in zip(self.sources, self.edge_relations, self.targets, self.edge_weights):
+            f.write('\t'.join((self.node_label(s) if s >= 0 else '', self.relations[r],
+                               self.node_label(t) if t >= 0 else '', str(int(w)))) + '\n')
+        f.close()
+
+    def write_graphml(self, path, salience=None):
+        """
+        GraphML of the concept map, edges without an agent or a patient are left out
+        """
+        f = open(path, 'w')
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                '  <key id="concept" for="node" attr.name="concept" attr.type="string"/>\n'
+                '  <key id="name" for="node" attr.name="name" attr.type="string"/>\n'
+                '  <key id="salience" for="node" attr.name="salience" attr.type="double"/>\n'
+                '  <key id="label" for="edge" attr.name="label" attr.type="string"/>\n'
+                '  <key id="weight" for="edge" attr.name="weight" attr.type="double"/>\n'
+                '  <graph edgedefault="directed">\n')
+        for node_id in range(len(self)):
+            f.write('    <node id="n' + str(node_id) + '"><data key="concept">'
+                    + escape(self.concepts[self.node_concepts[node_id]]) + '</data>')
+            if self.names[node_id] is not None:
+                f.write('<data key="name">' + escape(self.names[node_id]) + '</data>')
+            if salience is not None:
+                f.write('<data key="salience">' + repr(float(salience[node_id])) + '</data>')
+            f.write('</node>\n')
+        for edge_id, (s, r, t, w) in enumerate(zip(self.sources, self.edge_relations, self.targets,
+                                                   self.edge_weights)):
+            if s < 0 or t < 0:
+                continue
+            f.write('    <edge id="e' + str(edge_id) + '" source="n' + str(s) + '" target="n' + str(t) + '">'
+                    + '<data key="label">' + escape(self.relations[r]) + '</data>'
+                    + '<data key="weight">' + repr(float(w)) + '</data></edge>\n')
+        f.write('  </graph>\n</graphml>\n')
+        f.close()
+
+    def to_dict(self) -> dict:
+        """
+        The arrays and id tables, for pickling
+        """
+        return {'adjacency': self.adjacency, 'concepts': self.concepts, 'relations': self.relations,
+                'node_concepts': self.node_concepts, 'names': self.names, 'sources': self.sources,
+                'targets': self.targets, 'edge_relations': self.edge_relations,
+                'edge_weights': self.edge_weights, 'mentions': self.mentions}
@@ -0,0 +1,114 @@
+"""
+Merge the per-sentence triples of a document into one concept map.
+Argument nodes are deduplicated across sentences by hashing a normalized subgraph key
+(the concept plus its :name ops), so merging is linear in the number of triples instead
+of comparing every pair of sentences.
+"""
+import re
+from collections import defaultdict
+from amr_hackathon import amr
+
+RE_OP = re.compile(r':op(\d+)$')
+
+
+def graph_index(amr_obj):
+    """
+    Index the role triples of an AMR by head in a single pass
+    """
+    index = defaultdict(list)
+    for h, r, d in amr_obj.role_triples():
+        index[h].append((r, d))
+    return index
+
+
+def entity_signature(amr_obj, var, index=None):
+    """
+    Normalized subgraph of a variable: its concept and, for named entities, the lowercased :name ops
+    in op order. Variable names do not take part, so the same entity gets the same key in every sentence.
+    """
+    if index is None:
+        index = graph_index(amr_obj)
+    concept = amr_obj.concept(var)._name
+    ops = ()
+    for r, d in index[var]:
+        if r == ':name' and isinstance(d, amr.Var):
+            name_ops = []
+            for r2, d2 in index[d]:
+                m = RE_OP.match(r2)
+                if m:
+                    name_ops.append((int(m.group(1)), getattr(d2, '_value', str(d2)).lower()))
+            ops = tuple(op for _, op in sorted(name_ops))
+            break
+    return concept, ops
+
+
+class DocumentCMapMerger:
+    """
+    Build a document concept map from the sentence triples produced by AMRtoTriples.convert
+    """
+    def __init__(self, merge_unnamed=False):
+        # When merge_unnamed is set, nodes without a :name are merged by concept as well,
+        # otherwise they only stand for themselves within their sentence
+        self.merge_unnamed = merge_unnamed
+        self.nodes = []
+        self.edges = []
+        self.node_ids = {}
+        self.edge_ids = {}
+
+    def get_node(self, snt_id, amr_obj, var, index):
+        concept, ops = entity_signature(amr_obj, var, index)
+        if ops:
+            key = ('named', concept, ops)
+        elif self.merge_unnamed:
+            key = ('concept', concept)
+        else:
+            key = ('local', snt_id, var._name)
+        node_id = self.node_ids.get(key)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.node_ids[key] = node_id
+            self.nodes.append({
+                'id': node_id,
+                'concept': concept,
+                'name': ' '.join(ops) if ops else None,
+                'mentions': []
+            })
+        self.nodes[node_id]['mentions'].append((snt_id, var._name))
+        return node_id
+
+    def add_edge(self, snt_id, source, label, target):
+        key = (source, label, target)
+        edge_id = self.edge_ids.get(key)
+        if edge_id is None:
+            edge_id = len(self.edges)
+            self.edge_ids[key] = edge_id
+            self.edges.append({'id': edge_id, 'source': source, 'label': label, 'target': target, 'mentions': []})
+        self.edges[edge_id]['mentions'].append(snt_id)
+
+    def add_sentence(self, snt_id, amr_obj, triples):
+        """
+        Add the triples of one sentence. triples is the dict returned by AMRtoTriples.convert,
+        mapping the predicate variable to [agent, predicate, [patients]], or its plain string form.
+        """
+        index = graph_index(amr_obj)
+        var2c = amr_obj.var2concept()
+        for agent, predicate, patients in triples.values():
+            if isinstance(predicate, str):
+                agent = None if agent is None else amr.Var(agent)
+                predicate = amr.Var(predicate)
+                patients = [amr.Var(patient) for patient in patients]
+            label = var2c[predicate]._name
+            source = self.get_node(snt_id, amr_obj, agent, index) if agent in var2c else None
+            targets = [self.get_node(snt_id, amr_obj, patient, index) for patient in patients if patient in var2c]
+            # a predicate with an agent but no patient gets an edge without a target
+            if not targets and source is not None:
+                targets = [None]
+            for target in targets:
+                self.add_edge(snt_id, source, label, target)
+
+    def cmap(self) -> dict:
+        """
+        The merged concept map: nodes with their sentence mentions, and labelled edges between node ids
+        (the source or the target of an edge is None when its predicate has no agent or no patient)
+        """
+        return {'nodes': self.nodes, 'edges': self.edges}
@@ -0,0 +1,104 @@
+"""
+Corpus-wide concept salience for pruning the concept maps of long documents.
+The concepts of the converted triples (named entities resolved to their concept and :name ops, see
+CMapMerger.entity_signature) are counted into a sparse document x concept matrix, scored by TF-IDF
+or frequency in one vectorized pass, and the top-k concepts of every document are selected by a
+single sort of the nonzero scores.
+"""
+import numpy as np
+from scipy import sparse
+from amr_hackathon import amr
+from amr_lib.CMapMerger import graph_index, entity_signature
+
+
+def concept_keys(amr_obj, triples) -> dict:
+    """
+    Concept key of every variable of the triples: its concept, and for a named entity its name as well
+    """
+    index = graph_index(amr_obj)
+    var2c = amr_obj.var2concept()
+    keys = {}
+    for agent, predicate, patients in triples.values():
+        for x in [agent, predicate] + list(patients):
+            if x is None:
+                continue
+            v = amr.Var(str(x))
+            if v in var2c and str(v) not in keys:
+                concept, ops = entity_signature(amr_obj, v, index)
+                keys[str(v)] = concept + ' "' + ' '.join(ops) + '"' if ops else concept
+    return keys
+
+
+class ConceptSalience:
+
+    def __init__(self, top_k=20, method='tfidf'):
+        self.top_k = top_k
+        self.method = method
+        self.documents = []
+        self.document_ids = {}
+        self.concepts = []
+        self.concept_ids = {}
+        self.rows = []
+        self.cols = []
+        self.matrix = None
+        self.scores = None
+
+    def add_sentence(self, doc_key, keys):
+        """
+        Count the concepts of a sentence (the values of concept_keys) for its document
+        """
+        row = self.document_ids.setdefault(doc_key, len(self.document_ids))
+        if row == len(self.documents):
+            self.documents.append(doc_key)
+        for key in keys.values():
+            self.rows.append(row)
+            self.cols.append(self.concept_ids.setdefault(key, len(self.concept_ids)))
+
+    def fit(self) -> dict:
+        """
+        Score every concept of every document and return the set of top-k concept keys by document
+        """
+        self.concepts = list(self.concept_ids)
+        shape = (len(self.documents), len(self.concepts))
+        # duplicate entries are summed into counts
+        self.matrix = sparse.csr_matrix((np.ones(len(self.rows)), (self.rows, self.cols)), shape=shape)
+        self.rows = []
+        self.cols = []
+        scores = self.matrix.copy()
+        if self.method == 'tfidf':
+            df = np.bincount(scores.indices, minlength=shape[1])
+            idf = np.log((1.0 + shape[0]) / (1.0 + df)) + 1.0
+            scores.data = (1.0 + np.log(scores.data)) * idf[scores.indices]
+        self.scores = scores
+        # rank the scores within each row, highest first, with one sort over all nonzeros
+        rows = np.repeat(np.arange(shape[0]), np.diff(scores.indptr))
+        order = np.lexsort((scores.indices, -scores.data, rows))
+        rank = np.arange(len(order)) - scores.indptr[rows[order]]
+        selected = order[rank < self.top_k]
+        salient = {doc_key: set() for doc_key in self.documents}
+        for row, col in zip(rows[selected], scores.indices[selected]):
+            salient[self.documents[row]].add(self.concepts[col])
+        return salient
+
+    @staticmethod
+    def prune_triples(triples, keys, salient) -> dict:
+        """
+        Keep the triples whose predicate or agent is salient with all their patients (even if they have none),
+        and of the other triples the salient patients, if there are any
+        """
+        def is_salient(x):
+            return x is not None and keys.get(str(x)) in salient
+
+        pruned = {}
+        for key, (agent, predicate, patients) in triples.items():
+            if is_salient(predicate) or is_salient(agent):
+                pruned[key] = [agent, predicate, list(patients)]
+            else:
+                kept = [patient for patient in patients if is_salient(patient)]
+                if kept:
+                    pruned[key] = [agent, predicate, kept]
+        return pruned
+
+    def to_dict(self) -> dict:
+        return {'documents': self.documents, 'concepts': self.concepts, 'matrix': self.matrix,
+                'scores': self.scores, 'top_k': self.top_k, 'method': self.method}
@@ -0,0 +1,263 @@
+"""
+Smatch scoring of AMR pairs over AMR.triples().
+The best variable mapping is searched by hill-climbing from a concept-matching start and random restarts.
+Candidate pairs are pruned to variables that share at least one matching triple, and every hill-climbing
+step scores all its moves (single remaps and swaps) at once on NumPy arrays: a matrix of unary matches
+(instances and attributes) and the list of relation matches between two mapped pairs.
+Corpus scoring spreads pairs, or single restarts, over processes.
+
+usage: python -m amr_lib.Smatch [--restarts 4] [--workers 4] test_file gold_file
+"""
+import sys
+import argparse
+from collections import defaultdict
+from multiprocessing import Pool
+import numpy as np
+from amr_hackathon import amr
+
+# relations that end in -of but are not inverses
+NON_INVERSE = {':consist-of', ':prep-on-behalf-of', ':prep-out-of'}
+
+
+def smatch_triples(amr_obj):
+    """
+    The triples Smatch matches, with the variables numbered: (variable count, instances, attributes, relations).
+    Instances are (var, concept), attributes (var, relation, value) including the :top attribute of the root,
+    whose value is the root concept as in the reference smatch, relations (var, relation, var) with inverse
+    relations normalized. Labels and values are lowercased.
+
+    >>> n, instances, attributes, relations = smatch_triples(amr.AMR('(h / hug-01 :ARG1 (p / person :ARG0-of h))'))
+    >>> n, instances, attributes, relations
+    (2, [(0, 'hug-01'), (1, 'person')], [(0, ':top', 'hug-01')], [(0, ':arg1', 1), (0, ':arg0', 1)])
+    """
+    var_ids = {}
+    instances = []
+    attributes = []
+    relations = []
+    var2c = amr_obj.var2concept()
+    for v, c in var2c.items():
+        var_ids[v] = len(var_ids)
+        instances.append((var_ids[v], c._name.lower()))
+    for h, r, d in amr_obj.triples():
+        if r == ':instance-of':
+            continue
+        if r == ':top':
+            attributes.append((var_ids[d], ':top', var2c[d]._name.lower()))
+        elif isinstance(d, amr.Var):
+            rel = amr_obj.relation(r)
+            if rel.is_inverse and r not in NON_INVERSE:
+                relations.append((var_ids[d], rel.base.lower(), var_ids[h]))
+            else:
+                relations.append((var_ids[h], r.lower(), var_ids[d]))
+        else:
+            attributes.append((var_ids[h], r.lower(), getattr(d, '_value', str(d)).lower()))
+    return len(var_ids), instances, attributes, relations
+
+
+class SmatchPair:
+    """
+    The match structure of a (test, gold) pair of smatch_triples, and the hill-climbing search over it
+    """
+    def __init__(self, test, gold):
+        self.n1, instances1, attributes1, relations1 = test
+        self.n2, instances2, attributes2, relations2 = gold
+        self.total1 = len(instances1) + len(attributes1) + len(relations1)
+        self.total2 = len(instances2) + len(attributes2) + len(relations2)
+        # unary[i, j]: instance and attribute matches of mapping i to j, the last column stands for unmapped
+        self.unary = np.zeros((self.n1, self.n2 + 1), dtype=np.int32)
+        for triples1, triples2 in ((instances1, instances2), (attributes1, attributes2)):
+            index = defaultdict(list)
+            for t in triples2:
+                index[t[1:]].append(t[0])
+            for t in triples1:
+                for j in index.get(t[1:], ()):
+                    self.unary[t[0], j] += 1
+        # relation matches (i, j, k, l), counted when i maps to j and k to l
+        index = defaultdict(list)
+        for j, r, l in relations2:
+            index[r].append((j, l))
+        quads = defaultdict(int)
+        for i, r, k in relations1:
+            for j, l in index.get(r, ()):
+                if i == k and j == l:
+                    self.unary[i, j] += 1
+                elif i != k and j != l:
+                    quads[(i, j, k, l)] += 1
+        quad_array = np.array(list(quads.keys()), dtype=np.int32).reshape(-1, 4)
+        self.qi, self.qj, self.qk, self.ql = quad_array.T
+        self.qw = np.array(list(quads.values()), dtype=np.int32)
+        # candidate pruning: only pairs taking part in a match are ever mapped
+        self.candidates = self.unary[:, :self.n2] > 0
+        self.candidates[self.qi, self.qj] = True
+        self.candidates[self.qk, self.ql] = True
+
+    def score(self, mappings):
+        """
+        Number of matching triples of every row of a (rows, n1) mapping matrix, -1 is unmapped
+        """
+        columns = np.where(mappings < 0, self.n2, mappings)
+        scores = self.unary[np.arange(self.n1), columns].sum(axis=1)
+        if len(self.qw):
+            active = (mappings[:, self.qi] == self.qj) & (mappings[:, self.qk] == self.ql)
+            scores = scores + active @ self.qw
+        return scores
+
+    def initial_mapping(self, rng=None):
+        """
+        Concept-matching start without rng, otherwise a random mapping among the candidates
+        """
+        mapping = np.full(self.n1, -1, dtype=np.int32)
+        used = np.zeros(self.n2, dtype=bool)
+        order = np.arange(self.n1) if rng is None else rng.permutation(self.n1)
+        for i in order:
+            free = np.flatnonzero(self.candidates[i] & ~used)
+            if len(free) == 0:
+                continue
+            if rng is None:
+                j = free[np.argmax(self.unary[i, free])]
+                if self.unary[i, j] == 0:
+                    continue
+            else:
+                j = rng.choice(free)
+            mapping[i] = j
+            used[j] = True
+        return mapping
+
+    def moves(self, mapping):
+        """
+        Every mapping one step away: one variable remapped to a free candidate or unmapped, or two swapped
+        """
+        used = np.zeros(self.n2 + 1, dtype=bool)
+        used[mapping[mapping >= 0]] = True
+        a, b = np.nonzero(self.candidates & ~used[:self.n2])
+        unmap = np.flatnonzero(mapping >= 0)
+        a = np.concatenate((a, unmap))
+        b = np.concatenate((b, np.full(len(unmap), -1, dtype=np.int64)))
+        rows = np.tile(mapping, (len(a), 1))
+        rows[np.arange(len(a)), a] = b
+        # swaps, pruned to pairs where at least one side moves to a candidate
+        x, y = np.triu_indices(self.n1, 1)
+        mx = mapping[x]
+        my = mapping[y]
+        keep = (mx != my) & ((my >= 0) & self.candidates[x, np.maximum(my, 0)]
+                             | (mx >= 0) & self.candidates[y, np.maximum(mx, 0)])
+        x, y = x[keep], y[keep]
+        swaps = np.tile(mapping, (len(x), 1))
+        swaps[np.arange(len(x)), x] = mapping[y]
+        swaps[np.arange(len(x)), y] = mapping[x]
+        return np.concatenate((rows, swaps))
+
+    def hill_climb(self, mapping):
+        best = self.score(mapping[None])[0]
+        while True:
+            moves = self.moves(mapping)
+            if len(moves) == 0:
+                return best, mapping
+            scores = self.score(moves)
+            k = np.argmax(scores)
+            if scores[k] <= best:
+                return best, mapping
+            best, mapping = scores[k], moves[k]
+
+    def best_match(self, restarts=4, seed=0, restart_ids=None):
+        """
+        Best number of matching triples over the restarts (restart 0 starts from the concept matches)
+        """
+        best = 0
+        best_mapping = np.full(self.n1, -1, dtype=np.int32)
+        if self.n1 == 0 or self.n2 == 0:
+            return best, best_mapping
+        for restart in (range(restarts) if restart_ids is None else restart_ids):
+            rng = None if restart == 0 else np.random.default_rng((seed, restart))
+            match, mapping = self.hill_climb(self.initial_mapping(rng))
+            if match > best:
+                best, best_mapping = match, mapping
+            if best == min(self.total1, self.total2):
+                break
+        return int(best), best_mapping
+
+
+def f_score(match, total1, total2):
+    """
+    (precision, recall, f-score) of a match count between test and gold triple counts
+    """
+    precision = match / total1 if total1 else 0.0
+    recall = match / total2 if total2 else 0.0
+    f = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f
+
+
+def smatch(test, gold, restarts=4, seed=0):
+    """
+    Smatch (precision, recall, f-score) of two AMRs, given as AMR objects or Penman strings
+
+    >>> smatch('(h / hug-01 :ARG1 (p / person))', '(x / hug-01 :ARG1 (y / person))')
+    (1.0, 1.0, 1.0)
+    >>> smatch('(h / hug-01 :ARG1 (p / person))', '(x / hug-01 :ARG0 (y / person))')
+    (0.75, 0.75, 0.75)
+    """
+    pair = SmatchPair(*(smatch_triples(a if isinstance(a, amr.AMR) else amr.AMR(a, lazy=True))
+                        for a in (test, gold)))
+    return f_score(pair.best_match(restarts, seed)[0], pair.total1, pair.total2)
+
+
+def match_task(task):
+    test, gold, restarts, seed, restart_ids = task
+    pair = SmatchPair(test, gold)
+    return pair.best_match(restarts, seed, restart_ids)[0], pair.total1, pair.total2
+
+
+def score_corpus(pairs, restarts=4, seed=0, workers=1, split_restarts=False, chunksize=16):
+    """
+    Corpus Smatch of (test, gold) pairs of smatch_triples: the match and triple counts are summed over the
+    pairs before scoring. With workers, pairs are matched in a process pool; with split_restarts every
+    restart is its own task, which also spreads the restarts of a single hard pair over processes.
+    Returns (precision, recall, f-score).
+    """
+    tasks = []
+    for n, (test, gold) in enumerate(pairs):
+        if split_restarts:
+            tasks.extend((n, (test, gold, restarts, seed, [restart])) for restart in range(restarts))
+        else:
+            tasks.append((n, (test, gold, restarts, seed, None)))
+    results = {}
+    if workers > 1:
+        with Pool(workers) as pool:
+            outputs = pool.imap(match_task, [task for _, task in tasks], chunksize=chunksize)
+            for (n, _), output in zip(tasks, outputs):
+                results[n] = max(results.get(n, output), output)
+    else:
+        for n, task in tasks:
+            output = match_task(task)
+            results[n] = max(results.get(n, output), output)
+    match = sum(r[0] for r in results.values())
+    total1 = sum(r[1] for r in results.values())
+    total2 = sum(r[2] for r in results.values())
+    return f_score(match, total1, total2)
+
+
+def main():
+    from amr_lib.StreamTriples import read_graphs
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--restarts', help='Number of hill-climbing restarts per pair.', type=int, default=4)
+    parser.add_argument('--seed', help='Seed of the random restarts.', type=int, default=0)
+    parser.add_argument('--workers', help='Number of matching processes.', type=int, default=1)
+    parser.add_argument('--split_restarts', help='Run every restart as its own task', action='store_true')
+    parser.add_argument('test_file', help='Test AMRs, one per line or blank-line separated.')
+    parser.add_argument('gold_file', help='Gold AMRs, in the same order.')
+    args = parser.parse_args()
+    graphs = []
+    for path in (args.test_file, args.gold_file):
+        infile = open(path)
+        graphs.append([smatch_triples(amr.AMR(g, lazy=True)) for _, g in read_graphs(infile)])
+        infile.close()
+    if len(graphs[0]) != len(graphs[1]):
+        raise Exception('The test and gold files have a different number of AMRs')
+    precision, recall, f = score_corpus(zip(*graphs), args.restarts, args.seed, args.workers, args.split_restarts)
+    print('Precision: %.4f' % precision)
+    print('Recall: %.4f' % recall)
+    print('F-score: %.4f' % f)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Join the AMR triples of a sentence with its OpenIE extractions through token spans.
+Every AMR triple (agent, predicate, patient) is projected onto the tokens its subgraphs are aligned to
+(see AlignmentIndex), the OpenIE arguments are located in the sentence tokens, and the extractions are
+indexed by the span of their relation in an interval tree. A triple matches an extraction when its
+predicate overlaps the relation, its patient an object argument and its agent (if any) the subject.
+"""
+import re
+import numpy as np
+from amr_hackathon import amr
+from amr_lib.AlignmentIndex import AlignmentIndex
+
+RE_EXTRACTION = re.compile(r'^([0-9.]+) (?:Context\(.*?\):)?\((.*)\)$')
+RE_ARG_PREFIX = re.compile(r'^[A-Z]:')
+
+
+class IntervalTree:
+    """
+    Static centered interval tree over [start, end) intervals with payloads
+
+    >>> tree = IntervalTree([(0, 2, 'a'), (1, 5, 'b'), (6, 8, 'c')])
+    >>> sorted(tree.overlap(1, 2)), sorted(tree.overlap(5, 6)), sorted(tree.overlap(4, 7))
+    (['a', 'b'], [], ['b', 'c'])
+    """
+    def __init__(self, intervals):
+        self.center = None
+        self.left = self.right = None
+        if not intervals:
+            return
+        # the median start is covered by its own interval, so every level takes at least one
+        starts = sorted(start for start, _, _ in intervals)
+        self.center = starts[len(starts) // 2]
+        here = [iv for iv in intervals if iv[0] <= self.center < iv[1]]
+        left = [iv for iv in intervals if iv[1] <= self.center]
+        right = [iv for iv in intervals if iv[0] > self.center]
+        # intervals at the center, by start (for queries left of it) and by end (right of it)
+        self.by_start = sorted(here, key=lambda iv: iv[0])
+        self.by_end = sorted(here, key=lambda iv: -iv[1])
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def overlap(self, start, end):
+        """
+        Payloads of the intervals overlapping [start, end)
+        """
+        if self.center is None or start >= end:
+            return []
+        results = []
+        if end <= self.center:
+            for iv in self.by_start:
+                if iv[0] >= end:
+                    break
+                results.append(iv[2])
+            if self.left is not None:
+                results.extend(self.left.overlap(start, end))
+        elif start >= self.center:
+            for iv in self.by_end:
+                if iv[1] <= start:
+                    break
+                results.append(iv[2])
+            if self.right is not None:
+                results.extend(self.right.overlap(start, end))
+        else:
+            results.extend(iv[2] for iv in self.by_start)
+            if self.left is not None:
+                results.extend(self.left.overlap(start, end))
+            if self.right is not None:
+                results.extend(self.right.overlap(start, end))
+        return results
+
+
+def phrase_span(phrase, tok, positions):
+    """
+    [start, end) token span of a phrase in the sentence: its first contiguous occurrence, otherwise the
+    range of those of its tokens that occur in the sentence, None if none does
+
+    >>> tok = 'NATO considers cyber attacks a threat'.split()
+    >>> positions = {}
+    >>> for i, t in enumerate(tok): positions.setdefault(t, []).append(i)
+    >>> phrase_span('cyber attacks', tok, positions), phrase_span('a big threat', tok, positions)
+    ((2, 4), (4, 6))
+    """
+    words = phrase.split()
+    if not words:
+        return None
+    for start in positions.get(words[0], ()):
+        if tok[start:start + len(words)] == words:
+            return start, start + len(words)
+    found = [p for w in words for p in positions.get(w, ())[:1]]
+    if not found:
+        return None
+    return min(found), max(found) + 1
+
+
+def parse_openie_block(lines, tok):
+    """
+    Extractions of one OpenIE output block (the sentence line, then one line per extraction), as
+    (arg1 span, relation span, [object spans]) in the sentence tokens
+    """
+    positions = {}
+    for i, t in enumerate(tok):
+        positions.setdefault(t, []).append(i)
+    extractions = []
+    for line in lines[1:]:
+        m = RE_EXTRACTION.match(line.strip())
+        if not m:
+            continue
+        parts = [phrase_span(RE_ARG_PREFIX.sub('', part.strip()), tok, positions) for part in m.group(2).split(';')]
+        if len(parts) < 2:
+            continue
+        extractions.append((parts[0], parts[1], [p for p in parts[2:] if p is not None]))
+    return extractions
+
+
+def amr_triple_tokens(amr_data):
+    """
+    Token offsets of every AMR triple of a sentence: a (agent, predicate, patient) array triple per patient
+    of every predicate, the agent (or patient) array is None when there is none
+    """
+    amr_obj = amr_data.get('amr_obj') or amr.AMR(amr_data['amr'], amr_data['tok'], lazy=True)
+    index = AlignmentIndex(amr_obj)
+    var2c = amr_obj.var2concept()
+    cache = {}
+
+    def tokens(x):
+        v = amr.Var(str(x))
+        if v not in var2c:
+            return None
+        if v not in cache:
+            cache[v] = index.subgraph_tokens(v)
+        return cache[v]
+
+    triple_tokens = []
+    for agent, predicate, patients in amr_data['triples'].values():
+        v = amr.Var(str(predicate))
+        predicate_tokens = np.array(amr_obj.alignment_offsets((v, ':instance-of', var2c[v])), dtype=np.int32)
+        agent_tokens = None if agent is None else tokens(agent)
+        for patient in (patients or [None]):
+            triple_tokens.append((agent_tokens, predicate_tokens, None if patient is None else tokens(patient)))
+    return triple_tokens
+
+
+def overlaps(tokens, span):
+    return span is not None and tokens is not None and bool(((tokens >= span[0]) & (tokens < span[1])).any())
+
+
+def align_sentence(triple_tokens, extractions):
+    """
+    Match the AMR triples of a sentence with its extractions, returns the matched (triple, extraction) pairs
+    """
+    tree = IntervalTree([(rel[0], rel[1], n) for n, (arg1, rel, objects) in enumerate(extractions)
+                         if rel is not None])
+    pairs = []
+    for t, (agent_tokens, predicate_tokens, patient_tokens) in enumerate(triple_tokens):
+        if len(predicate_tokens) == 0:
+            continue
+        for n in tree.overlap(int(predicate_tokens.min()), int(predicate_tokens.max()) + 1):
+            arg1, rel, objects = extractions[n]
+            if not overlaps(predicate_tokens, rel):
+                continue
+            if agent_tokens is not None and not overlaps(agent_tokens, arg1):
+                continue
+            if patient_tokens is not None and not any(overlaps(patient_tokens, span) for span in objects):
+                continue
+            pairs.append((t, n))
+    return sorted(pairs)
+
+
+def precision_recall(n_amr, n_openie, matched_amr, matched_openie):
+    """
+    Precision of the OpenIE extractions and recall of the AMR triples
+    """
+    precision = matched_openie / n_openie if n_openie else 0.0
+    recall = matched_amr / n_amr if n_amr else 0.0
+    return precision, recall
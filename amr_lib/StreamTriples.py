@@ -0,0 +1,129 @@
+"""
+Streaming AMR to triples conversion, e.g. of parser output on the fly.
+Reads Penman graphs from stdin or files, either one graph per line or blank-line separated with optional
+'# ::id', '# ::tok' (or '# ::snt') comment lines, and writes one JSON line per graph, in input order,
+as soon as its batch is converted. The amr_string_triples need aligned graphs and their tokens.
+
+usage: python -m amr_lib.StreamTriples --propbank_path frames --output_path out [--workers 4 [--threads]] [files ...]
+"""
+import sys
+import json
+import argparse
+import fileinput
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from amr_lib.AMRtoTriples import AMRtoTriples
+from amr_lib.TriplesExporter import resolve_triples, var_concepts
+from utils.PropBankReader import PropBankReader
+
+# PropBank agent table of a worker process, set once by init_worker
+worker_propbank = None
+
+
+def read_graphs(lines):
+    """
+    Yield a (metadata, amr_string) pair for every graph, a graph ends once its brackets are balanced
+
+    >>> [g for _, g in read_graphs(['(a / b :c (d / e))', '', '# ::id x.1', '(f / g', '   :h "(")'])]
+    ['(a / b :c (d / e))', '(f / g\\n   :h "(")']
+    """
+    metadata = {}
+    graph = []
+    depth = 0
+    for line in lines:
+        line = line.rstrip('\n')
+        if not graph:
+            if line.startswith('#'):
+                fields = line.split('::')
+                for field in fields[1:]:
+                    tokens = field.split()
+                    if tokens and tokens[0] in ('id', 'tok', 'snt'):
+                        metadata[tokens[0]] = tokens[1:]
+                continue
+            if line.strip() == '':
+                continue
+        graph.append(line)
+        # quoted constants may contain brackets
+        for i, part in enumerate(line.split('"')):
+            if i % 2 == 0:
+                depth += part.count('(') - part.count(')')
+        if depth <= 0:
+            yield metadata, '\n'.join(graph)
+            metadata = {}
+            graph = []
+            depth = 0
+    if graph:
+        yield metadata, '\n'.join(graph)
+
+
+def init_worker(propbank):
+    global worker_propbank
+    worker_propbank = propbank
+
+
+def convert_graph(item, propbank=None):
+    """
+    Convert one graph to its JSON record, a graph that can not be converted gets an error record.
+    The propbank defaults to the one of the worker process.
+    """
+    n, (metadata, amr_string) = item
+    if propbank is None:
+        propbank = worker_propbank
+    record = {'id': ' '.join(metadata['id']) if 'id' in metadata else str(n)}
+    tok = metadata.get('tok', metadata.get('snt', []))
+    try:
+        amr_to_triples = AMRtoTriples({'amr': amr_string, 'tok': tok}, propbank)
+        triples = amr_to_triples.convert()
+        amr_string_triples = amr_to_triples.generate_amr_string_from_triples()
+        record['triples'] = resolve_triples(triples, var_concepts(amr_to_triples.amr_obj))
+        record['amr_string_triples'] = [list(x) for x in amr_string_triples]
+    except Exception as e:
+        record['error'] = type(e).__name__ + ': ' + str(e)
+    return json.dumps(record)
+
+
+def stream_triples(lines, propbank, out, workers=1, batch_size=64, threads=False):
+    """
+    Convert the graphs read from lines and write their records to out, returns the number of graphs.
+    With threads, the workers are threads sharing the propbank instead of processes.
+    """
+    graphs = enumerate(read_graphs(lines))
+    count = 0
+    if workers > 1:
+        if threads:
+            pool, convert = ThreadPool(workers), partial(convert_graph, propbank=propbank)
+        else:
+            pool, convert = Pool(workers, initializer=init_worker, initargs=(propbank,)), convert_graph
+        with pool:
+            for record in pool.imap(convert, graphs, chunksize=batch_size):
+                out.write(record + '\n')
+                count += 1
+                if count % batch_size == 0:
+                    out.flush()
+    else:
+        for item in graphs:
+            out.write(convert_graph(item, propbank) + '\n')
+            out.flush()
+            count += 1
+    out.flush()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--propbank_path', help='Propbank directory.', required=True)
+    parser.add_argument('--output_path', help='Output directory, where the propbank agent table is cached.',
+                        required=True)
+    parser.add_argument('--workers', help='Number of converting processes.', type=int, default=1)
+    parser.add_argument('--threads', help='Convert in threads instead of processes', action='store_true')
+    parser.add_argument('--batch_size', help='Number of graphs sent to a worker at once.', type=int, default=64)
+    parser.add_argument('files', help='Input files, stdin if none is given.', nargs='*')
+    args = parser.parse_args()
+    propbank = PropBankReader(args.propbank_path, args.output_path).agent_table()
+    stream_triples(fileinput.input(args.files), propbank, sys.stdout, args.workers, args.batch_size,
+                   args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Canonical hashing of the AMR subgraph strings extracted for the AMR generator.
+Two strings get the same hash when they only differ in variable names, alignments or layout,
+which is the case for the same argument subgraph extracted from different triples.
+"""
+import re
+import hashlib
+
+RE_TOKEN = re.compile(r'\(|\)|"[^"]*"(?:~[A-Za-z0-9.,]+)?|[^\s()]+')
+RE_ALIGNMENT = re.compile(r'~[A-Za-z0-9.,]+$')
+
+
+class _Node:
+    __slots__ = ('var', 'concept', 'edges')
+
+    def __init__(self, var):
+        self.var = var
+        self.concept = None
+        self.edges = []
+
+
+def _parse(tokens):
+    """
+    Parse the tokens of a Penman string into a tree of _Node, edges are kept in their original order
+    """
+    pos = 0
+
+    def walk():
+        nonlocal pos
+        # tokens[pos] is the opening paren
+        node = _Node(tokens[pos + 1])
+        if tokens[pos + 2] != '/':
+            raise ValueError('Expected "/" after variable')
+        node.concept = RE_ALIGNMENT.sub('', tokens[pos + 3])
+        pos += 4
+        while tokens[pos] != ')':
+            role = RE_ALIGNMENT.sub('', tokens[pos])
+            pos += 1
+            if tokens[pos] == '(':
+                if tokens[pos + 2] == '/':
+                    node.edges.append((role, walk()))
+                else:
+                    # a wrapped bare value such as (-)
+                    node.edges.append((role, RE_ALIGNMENT.sub('', tokens[pos + 1])))
+                    pos += 3
+            else:
+                node.edges.append((role, RE_ALIGNMENT.sub('', tokens[pos])))
+                pos += 1
+        pos += 1
+        return node
+
+    root = walk()
+    if pos != len(tokens):
+        raise ValueError('Trailing tokens after the graph')
+    return root
+
+
+def canonical_amr_string(amr_string):
+    """
+    Rewrite an AMR string into a canonical single-line form with variables renamed by order of first
+    appearance (v0, v1, ...) and alignments dropped. Strings that are not a parsable graph, such as
+    a wrapped constant, are only whitespace normalized.
+
+    >>> canonical_amr_string('(m2 / military :name (n / name :op1 "NATO"))')
+    '(v0 / military :name (v1 / name :op1 "NATO"))'
+    >>> canonical_amr_string('(m / military \\n    :name (n3 / name \\n        :op1 "NATO"))')
+    '(v0 / military :name (v1 / name :op1 "NATO"))'
+    """
+    tokens = RE_TOKEN.findall(amr_string)
+    try:
+        root = _parse(tokens)
+    except (IndexError, ValueError):
+        return ' '.join(amr_string.split())
+
+    names = {}
+
+    def rename(node):
+        names.setdefault(node.var, 'v' + str(len(names)))
+        for _, child in node.edges:
+            if isinstance(child, _Node):
+                rename(child)
+
+    def render(node):
+        s = '(' + names[node.var] + ' / ' + node.concept
+        for role, child in node.edges:
+            if isinstance(child, _Node):
+                s += ' ' + role + ' ' + render(child)
+            else:
+                s += ' ' + role + ' ' + names.get(child, child)
+        return s + ')'
+
+    rename(root)
+    return render(root)
+
+
+def canonical_amr_hash(amr_string):
+    """
+    Variable-renaming-invariant hash of an AMR string
+    """
+    return hashlib.sha1(canonical_amr_string(amr_string).encode('utf-8')).hexdigest()
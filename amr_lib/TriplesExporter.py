@@ -0,0 +1,134 @@
+"""
+Streaming export of the converted sentences as JSON Lines or Parquet.
+Each record holds the triples of one sentence with the variables resolved to their concepts, and
+its amr_string_triples. Records are written as the converter produces them (Parquet in row groups),
+so the corpus never has to be held in memory for the export.
+"""
+import os
+import json
+
+
+def var_concepts(amr_obj):
+    """
+    Variable name -> concept name mapping of a parsed AMR
+
+    >>> from amr_hackathon import amr
+    >>> var_concepts(amr.AMR('(c / consider-02~e.1 :ARG0 (m2 / military) :ARG1 (t / thing :name "(a / fake)"))'))
+    {'c': 'consider-02', 'm2': 'military', 't': 'thing'}
+    """
+    return {str(v): c._name for v, c in amr_obj.var2concept().items()}
+
+
+def resolve_triples(triples, var2c):
+    """
+    Plain representation of the triples of a sentence, with variables resolved to concept names
+    """
+    def resolve(x):
+        if x is None:
+            return None, None
+        name = str(x)
+        if name in var2c:
+            return var2c[name], name
+        return name, None
+
+    records = []
+    for agent, predicate, patients in triples.values():
+        agent_concept, agent_var = resolve(agent)
+        patient_concepts = []
+        patient_vars = []
+        for patient in patients:
+            concept, var = resolve(patient)
+            patient_concepts.append(concept)
+            patient_vars.append(var)
+        records.append({
+            'predicate': var2c.get(str(predicate)),
+            'predicate_var': str(predicate),
+            'agent': agent_concept,
+            'agent_var': agent_var,
+            'patients': patient_concepts,
+            'patient_vars': patient_vars
+        })
+    return records
+
+
+class TriplesExporter:
+
+    def __init__(self, path, fmt='jsonl', row_group_size=10000):
+        self.path = path
+        self.fmt = fmt
+        self.row_group_size = row_group_size
+        self.count = 0
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        if fmt == 'jsonl':
+            self.outfile = open(path, 'w')
+        elif fmt == 'parquet':
+            # pyarrow is only needed for Parquet export
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.pa = pa
+            self.schema = pa.schema([
+                ('dataset', pa.string()),
+                ('doc', pa.string()),
+                ('id', pa.string()),
+                ('type', pa.string()),
+                ('tok', pa.string()),
+                ('triples', pa.list_(pa.struct([
+                    ('predicate', pa.string()),
+                    ('predicate_var', pa.string()),
+                    ('agent', pa.string()),
+                    ('agent_var', pa.string()),
+                    ('patients', pa.list_(pa.string())),
+                    ('patient_vars', pa.list_(pa.string()))
+                ]))),
+                ('amr_string_triples', pa.list_(pa.struct([
+                    ('left', pa.string()),
+                    ('middle', pa.string()),
+                    ('right', pa.string())
+                ])))
+            ])
+            self.writer = pq.ParquetWriter(path, self.schema)
+            self.rows = []
+        else:
+            raise ValueError('Unknown export format: ' + fmt)
+
+    def write(self, dataset_name, doc_name, amr_id, amr_data, amr_obj):
+        """
+        Export one converted sentence of the corpus, with the AMR parsed by the converter
+        """
+        record = {
+            'dataset': dataset_name,
+            'doc': doc_name,
+            'id': amr_id,
+            'type': amr_data['type'],
+            'tok': ' '.join(amr_data['tok']),
+            'triples': resolve_triples(amr_data['triples'], var_concepts(amr_obj)),
+            'amr_string_triples': [{'left': left, 'middle': middle, 'right': right} for left, middle, right
+                                   in amr_data['amr_string_triples']]
+        }
+        self.count += 1
+        if self.fmt == 'jsonl':
+            self.outfile.write(json.dumps(record) + '\n')
+        else:
+            self.rows.append(record)
+            if len(self.rows) >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        if self.fmt == 'parquet' and self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        if self.fmt == 'jsonl':
+            self.outfile.close()
+        else:
+            self.flush()
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,197 @@
+"""
+Persistent inverted index over the converted triples, for finding sentences without scanning the corpus.
+Every triple (one predicate of a sentence with its agent and patients) gets an id, and its terms map to the
+sorted array of the ids of the triples they occur in:
+    pred:<concept>          the predicate concept, e.g. pred:attack-01
+    agent:<concept>         the agent concept, agent_name:<name> the :name of a named entity agent
+    patient:<concept>       a patient concept, patient_name:<name> the name of a named entity patient
+    arg:<concept>           the agent or a patient concept, name:<name> the agent or a patient name
+Names are lowercased, with the :name ops joined by spaces (quote names of several words).
+Queries combine terms with AND, OR, NOT and brackets, adjacent terms are conjunctive, and are answered with
+set operations on the posting arrays, e.g. "which triples have attack-01 with NATO as agent":
+    pred:attack-01 agent_name:nato
+
+usage: python -m amr_lib.TriplesIndex --output_path out [--sentences] 'pred:attack-01 agent_name:nato'
+"""
+import os
+import re
+import sys
+import pickle
+import argparse
+import numpy as np
+from amr_hackathon import amr
+from amr_lib.CMapMerger import graph_index, entity_signature
+
+FIELDS = {'pred', 'agent', 'agent_name', 'patient', 'patient_name', 'arg', 'name'}
+RE_QUERY_TOKEN = re.compile(r'\(|\)|[^\s()"]+:"[^"]*"|[^\s()]+')
+
+
+class TriplesIndex:
+
+    def __init__(self, output_path=None):
+        self.path = os.path.join(output_path, 'data', 'triples_index.pickle') if output_path else None
+        # triple id -> sentence id and predicate variable, sentence id -> (dataset, doc, amr_id)
+        self.sentences = []
+        self.triple_sentences = []
+        self.triple_keys = []
+        self.postings = {}
+
+    def add_triple(self, sentence_id, key, terms):
+        triple_id = len(self.triple_keys)
+        self.triple_sentences.append(sentence_id)
+        self.triple_keys.append(key)
+        for term in terms:
+            # ids only grow, so the posting lists stay sorted
+            postings = self.postings.setdefault(term, [])
+            if not postings or postings[-1] != triple_id:
+                postings.append(triple_id)
+
+    def write(self, dataset_name, doc_name, amr_id, amr_data, amr_obj=None):
+        """
+        Index the triples of a converted sentence, with the same interface as TriplesExporter. The AMR is only
+        parsed when its graph is not given.
+        """
+        triples = amr_data['triples']
+        if not triples:
+            return
+        sentence_id = len(self.sentences)
+        self.sentences.append((dataset_name, doc_name, amr_id))
+        if amr_obj is None:
+            amr_obj = amr_data.get('amr_obj') or amr.AMR(amr_data['amr'], amr_data['tok'], lazy=True)
+        index = graph_index(amr_obj)
+        var2c = amr_obj.var2concept()
+        signatures = {}
+
+        def signature(x):
+            v = amr.Var(str(x))
+            if v not in var2c:
+                return str(x), ''
+            if v not in signatures:
+                concept, ops = entity_signature(amr_obj, v, index)
+                signatures[v] = concept, ' '.join(ops)
+            return signatures[v]
+
+        for key, (agent, predicate, patients) in triples.items():
+            terms = ['pred:' + signature(predicate)[0]]
+            for role, args in (('agent', [] if agent is None else [agent]), ('patient', patients)):
+                for arg in args:
+                    concept, name = signature(arg)
+                    terms += [role + ':' + concept, 'arg:' + concept]
+                    if name:
+                        terms += [role + '_name:' + name, 'name:' + name]
+            self.add_triple(sentence_id, str(key), terms)
+
+    def close(self):
+        """
+        Turn the posting lists into arrays and save the index
+        """
+        self.postings = {term: np.array(ids, dtype=np.int32) for term, ids in self.postings.items()}
+        self.triple_sentences = np.array(self.triple_sentences, dtype=np.int32)
+        if self.path is not None:
+            self.save_data()
+
+    def save_data(self):
+        output_file = open(self.path, 'wb')
+        pickle.dump((self.sentences, self.triple_sentences, self.triple_keys, self.postings), output_file, -1)
+        output_file.close()
+
+    def load_data(self):
+        infile = open(self.path, 'rb')
+        self.sentences, self.triple_sentences, self.triple_keys, self.postings = pickle.load(infile)
+        infile.close()
+        return self
+
+    def term_ids(self, term):
+        field, _, value = term.partition(':')
+        if field not in FIELDS or not value:
+            raise Exception('Unknown query term ' + term + ', terms are ' + ', '.join(sorted(FIELDS)) + ':<value>')
+        value = value.strip('"')
+        if field.endswith('name'):
+            value = ' '.join(value.lower().split())
+        return self.postings.get(field + ':' + value, np.empty(0, dtype=np.int32))
+
+    def query_ids(self, query):
+        """
+        Sorted ids of the triples matching a query
+
+        >>> index = TriplesIndex()
+        >>> index.write('dev', 'd1', '1', {'tok': [], 'triples': {amr.Var('a'): [amr.Var('m'), amr.Var('a'), []]},
+        ...     'amr': '(a / attack-01 :ARG0 (m / military :name (n / name :op1 "NATO")))'})
+        >>> index.write('dev', 'd1', '2', {'tok': [], 'triples': {amr.Var('a'): [amr.Var('p'), amr.Var('a'), []]},
+        ...     'amr': '(a / attack-01 :ARG0 (p / person))'})
+        >>> index.close()
+        >>> index.query_ids('pred:attack-01 agent_name:NATO'), index.query_ids('pred:attack-01 AND NOT name:nato')
+        (array([0], dtype=int32), array([1], dtype=int32))
+        >>> index.query_ids('(agent:person OR agent:military) pred:attack-01')
+        array([0, 1], dtype=int32)
+        """
+        tokens = RE_QUERY_TOKEN.findall(query)
+        position = [0]
+
+        def peek():
+            return tokens[position[0]] if position[0] < len(tokens) else None
+
+        def take(expected=None):
+            token = peek()
+            if token is None or (expected is not None and token != expected):
+                raise Exception('Malformed query: ' + query)
+            position[0] += 1
+            return token
+
+        def parse_or():
+            ids = parse_and()
+            while peek() == 'OR':
+                take()
+                ids = np.union1d(ids, parse_and())
+            return ids
+
+        def parse_and():
+            ids = parse_not()
+            while peek() not in (None, ')', 'OR'):
+                if peek() == 'AND':
+                    take()
+                ids = np.intersect1d(ids, parse_not(), assume_unique=True)
+            return ids
+
+        def parse_not():
+            if peek() == 'NOT':
+                take()
+                return np.setdiff1d(np.arange(len(self.triple_keys), dtype=np.int32), parse_not(),
+                                    assume_unique=True)
+            if peek() == '(':
+                take()
+                ids = parse_or()
+                take(')')
+                return ids
+            return self.term_ids(take())
+
+        ids = parse_or()
+        if peek() is not None:
+            raise Exception('Malformed query: ' + query)
+        return ids.astype(np.int32)
+
+    def query(self, query, sentences=False):
+        """
+        (dataset, doc, amr_id, predicate variable) of every matching triple, or with sentences the
+        (dataset, doc, amr_id) of every sentence with a matching triple
+        """
+        ids = self.query_ids(query)
+        if sentences:
+            return [self.sentences[s] for s in np.unique(self.triple_sentences[ids])]
+        return [self.sentences[self.triple_sentences[i]] + (self.triple_keys[i],) for i in ids]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_path', help='Output directory of amr_cmap, holding data/triples_index.pickle.',
+                        required=True)
+    parser.add_argument('--sentences', help='List the matching sentences instead of triples', action='store_true')
+    parser.add_argument('query', help='Query, e.g. "pred:attack-01 agent_name:nato".')
+    args = parser.parse_args()
+    index = TriplesIndex(args.output_path).load_data()
+    for result in index.query(args.query, args.sentences):
+        print('\t'.join(result))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Memo of AMRtoTriples results, for the duplicate sentences (datelines, boilerplate) of the proxy corpora.
+Entries are keyed by the whitespace normalized AMR string and the sentence tokens, and evicted in
+least recently used order once the memo holds max_size entries.
+A persisted memo is saved with the fingerprint of the PropBank and converter code its entries were computed
+with, and is discarded on load when that fingerprint does not match the current one.
+"""
+import os
+import pickle
+from collections import OrderedDict
+
+
+class TriplesMemo:
+
+    def __init__(self, max_size=10000, path=None, fingerprint=None):
+        self.max_size = max_size
+        # when a path is given, the memo is loaded from and saved to that pickle file
+        self.path = path
+        self.fingerprint = fingerprint
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None and os.path.isfile(path):
+            self.load_data()
+
+    @staticmethod
+    def make_key(amr_data):
+        return ' '.join(amr_data['amr'].split()), tuple(amr_data['tok'])
+
+    @staticmethod
+    def copy_triples(triples):
+        return {key: [agent, predicate, list(patients)] for key, (agent, predicate, patients) in triples.items()}
+
+    def get(self, amr_data):
+        """
+        Return the memoized (triples, amr_string_triples) of the sentence, or None
+        """
+        key = self.make_key(amr_data)
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        triples, amr_string_triples = value
+        return self.copy_triples(triples), amr_string_triples[:]
+
+    def put(self, amr_data, triples, amr_string_triples):
+        if self.max_size <= 0:
+            return
+        key = self.make_key(amr_data)
+        self.entries[key] = (self.copy_triples(triples), amr_string_triples[:])
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return 'Triples memo: %d hits, %d misses (%.1f%% hit rate), %d evictions, %d entries' \
+               % (self.hits, self.misses, rate, self.evictions, len(self.entries))
+
+    def save_data(self):
+        output_file = open(self.path, 'wb')
+        pickle.dump({'fingerprint': self.fingerprint, 'entries': self.entries}, output_file, -1)
+        output_file.close()
+
+    def load_data(self):
+        infile = open(self.path, 'rb')
+        data = pickle.load(infile)
+        infile.close()
+        # entries of another propbank or converter version are not reused
+        if 'entries' in data and data['fingerprint'] == self.fingerprint:
+            self.entries = data['entries']
+        else:
+            self.entries = OrderedDict()
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return self.entries
@@ -0,0 +1,3 @@
+"""
+The tests in tests/ import the amr_lib and utils packages from the repository root, where this file is.
+"""
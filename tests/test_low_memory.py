@@ -0,0 +1,91 @@
+"""
+The low memory conversion mode keeps only plain string triples, so the memory used while converting stays
+flat as the corpus grows: besides the (small, plain) results kept for every sentence, at most the graph of
+the sentence being converted is alive.
+tracemalloc only sees the Python heap, the peak RSS of a fresh process also counts the C-level buffers.
+"""
+import os
+import gc
+import sys
+import subprocess
+import tracemalloc
+from amr_lib.AMRtoTriples import AMRCorpusExtConverter
+
+PROPBANK = {'say.01': frozenset({'0'}), 'attack.01': frozenset({'0'}), 'defend.01': frozenset({'0'})}
+N = 50
+
+
+def synthetic_corpus(n_sentences, sentences_per_doc=10):
+    corpus = {'dev': {}}
+    for i in range(n_sentences):
+        doc = corpus['dev'].setdefault('DOC_%04d' % (i // sentences_per_doc), {})
+        doc[str(i % sentences_per_doc + 1)] = {
+            'type': 'body',
+            'tok': ['Person%d' % i, 'said', 'Country%d' % i, 'attacked', 'the', 'city', 'it', 'defends'],
+            'amr': '(s / say-01~e.1 :ARG0 (p / person :name (n / name :op1 "Person%d"~e.0)) '
+                   ':ARG1 (a / attack-01~e.3 :ARG0 (c / country :name (n2 / name :op1 "Country%d"~e.2)) '
+                   ':ARG1 (c2 / city~e.5 :ARG1-of (d / defend-01~e.7 :ARG0 c))))' % (i, i)
+        }
+    return corpus
+
+
+def convert_memory(n_sentences):
+    """
+    (transient, retained) bytes allocated by a low memory conversion: the peak above what is still allocated
+    after it, and what is still allocated
+    """
+    converter = AMRCorpusExtConverter(synthetic_corpus(n_sentences), PROPBANK, '/nonexistent', low_memory=True)
+    gc.collect()
+    tracemalloc.start()
+    converter.update_amr_corpus_with_triples()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for doc in converter.amr_corpus['dev'].values():
+        for amr_data in doc.values():
+            assert 'amr_obj' not in amr_data
+            for key, (agent, predicate, patients) in amr_data['triples'].items():
+                assert all(type(x) is str for x in (key, predicate) + patients) and type(agent) in (str, type(None))
+    return peak - retained, retained
+
+
+def test_low_memory_peak_is_flat():
+    convert_memory(N)
+    transient, retained = convert_memory(N)
+    for k in (4, 8):
+        transient_k, retained_k = convert_memory(k * N)
+        # the working set of a conversion does not depend on the number of sentences
+        assert transient_k < 1.25 * transient + 64 * 1024
+        # and the results kept for every sentence do not grow either
+        assert retained_k / (k * N) < 1.25 * retained / N
+
+
+def peak_rss_growth(n_sentences):
+    """
+    KB the peak RSS of the process grows by while converting n_sentences in low memory mode (ru_maxrss is in KB
+    on Linux)
+    """
+    import resource
+    converter = AMRCorpusExtConverter(synthetic_corpus(n_sentences), PROPBANK, '/nonexistent', low_memory=True)
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    converter.update_amr_corpus_with_triples()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+
+def run_peak_rss_growth(n_sentences):
+    # in a fresh process, so the peak is not the one of an earlier test
+    tests_path = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(tests_path), tests_path]))
+    code = 'import test_low_memory; print(test_low_memory.peak_rss_growth(%d))' % n_sentences
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return int(output.stdout)
+
+
+def test_low_memory_peak_rss_per_sentence_is_flat():
+    n = 8 * N
+    growth = run_peak_rss_growth(n)
+    growth_k = run_peak_rss_growth(8 * n)
+    # the peak grows with the results kept for every sentence, but not faster than the number of sentences
+    # (with half a KB per sentence for the rounding of the RSS to pages)
+    assert growth_k / (8 * n) < 1.25 * growth / n + 0.5
@@ -0,0 +1,85 @@
+"""
+AMR parsing, conversion and rendering are reentrant: the same AMRs converted and rendered from many threads at
+once, sharing the lazily compiled grammar and the lazily built structures of shared AMR objects, give the same
+output as a serial run.
+"""
+import sys
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from amr_hackathon import amr
+from amr_lib.AMRtoTriples import AMRtoTriples, AMRCorpusExtConverter
+
+PROPBANK = {'say.01': frozenset({'0'}), 'attack.01': frozenset({'0'}), 'defend.01': frozenset({'0'}),
+            'want.01': frozenset({'0'})}
+THREADS = 16
+
+
+def synthetic_amrs(n):
+    amrs = []
+    for i in range(n):
+        tok = ['Person%d' % i, 'said', 'Country%d' % i, 'wants', 'to', 'attack', 'the', 'city', 'it', 'defends']
+        amr_string = ('(s / say-01~e.1 :ARG0 (p / person :wiki - :name (n / name :op1 "Person%d"~e.0)) '
+                      ':ARG1 (w / want-01~e.3 :ARG0 (c / country :name (n2 / name :op1 "Country%d"~e.2)) '
+                      ':ARG1 (a / attack-01~e.5 :ARG0 c :ARG1 (c2 / city~e.7 :ARG1-of (d / defend-01~e.9 '
+                      ':ARG0 c)) :polarity -)))' % (i, i))
+        amrs.append({'type': 'body', 'tok': tok, 'amr': amr_string})
+    return amrs
+
+
+def render(amr_data, amr_obj=None):
+    """
+    Everything derived from one AMR: its triples, amr strings, Penman and alignments
+    """
+    if amr_obj is not None:
+        amr_data = dict(amr_data, amr_obj=amr_obj)
+    amr_to_triples = AMRtoTriples(amr_data, PROPBANK)
+    triples = amr_to_triples.convert()
+    amr_string_triples = amr_to_triples.generate_amr_string_from_triples()
+    return (repr(triples), amr_string_triples, str(amr_to_triples.amr_obj),
+            sorted(map(repr, amr_to_triples.amr_obj.alignments().items())))
+
+
+def run_together(func, items):
+    """
+    func on every item from THREADS threads that all start at once, switching between them as often as possible
+    """
+    barrier = threading.Barrier(THREADS)
+
+    def start(item):
+        barrier.wait()
+        return func(item)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(THREADS) as pool:
+            return list(pool.map(start, items))
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def test_threads_match_serial():
+    amrs = synthetic_amrs(THREADS)
+    expected = [render(amr_data) for amr_data in amrs]
+    # the grammar is compiled again, by the first of the threads that need it
+    amr._grammar = None
+    assert run_together(render, amrs) == expected
+    # all threads render the same unparsed AMR object at once
+    for amr_data, result in zip(amrs, expected):
+        shared = amr.AMR(amr_data['amr'], amr_data['tok'], lazy=True)
+        assert run_together(lambda _: render(amr_data, shared), range(THREADS)) == [result] * THREADS
+
+
+def test_thread_pool_converter_matches_serial():
+    amrs = synthetic_amrs(200)
+    corpus = {'dev': {'DOC_%d' % (i // 10): {} for i in range(len(amrs))}}
+    for i, amr_data in enumerate(amrs):
+        corpus['dev']['DOC_%d' % (i // 10)][str(i % 10 + 1)] = amr_data
+    results = []
+    for threads in (1, THREADS):
+        converter = AMRCorpusExtConverter(copy.deepcopy(corpus), PROPBANK, '/nonexistent', threads=threads)
+        converted = converter.update_amr_corpus_with_triples()
+        results.append([(repr(amr_data['triples']), amr_data['amr_string_triples'])
+                        for doc in converted['dev'].values() for amr_data in doc.values()])
+    assert results[0] == results[1]
@@ -0,0 +1,176 @@
+"""
+Binary, memory-mapped store of pre-parsed AMR graphs with random access by sentence id.
+Every graph is kept as one record (tokens, Penman string, triples and alignments) in a
+single binary file, and an id -> (offset, length) index points into it, so one sentence
+can be materialized without loading or re-parsing the rest of the corpus.
+"""
+import os
+import mmap
+import pickle
+from amr_hackathon import amr
+
+# Element classes of the AMR triples and the code they are stored under
+ELEMENT_CODES = {
+    amr.Var: 'v',
+    amr.Concept: 'c',
+    amr.AMRConstant: 'k',
+    amr.AMRString: 's',
+    amr.AMRNumber: 'n'
+}
+CODE_ELEMENTS = {code: cls for cls, code in ELEMENT_CODES.items()}
+
+
+def encode_element(element):
+    """
+    Encode a Var, Concept or constant as a plain (code, text) tuple
+    """
+    if isinstance(element, (amr.Var, amr.Concept)):
+        return ELEMENT_CODES[type(element)], element._name
+    return ELEMENT_CODES[type(element)], element._value
+
+
+def decode_element(code, text, elts):
+    """
+    Decode an element, interning it in elts so equal elements share one object (as the parser does)
+    """
+    key = (code, text)
+    if key not in elts:
+        elts[key] = CODE_ELEMENTS[code](text)
+    return elts[key]
+
+
+class AMRGraphStore:
+
+    def __init__(self, output_path: str):
+        self.output_path = os.path.join(output_path, 'data')
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+        self.data_file = os.path.join(self.output_path, 'amr_graph.bin')
+        self.index_file = os.path.join(self.output_path, 'amr_graph.idx')
+        self.index = None
+        self._infile = None
+        self._mmap = None
+
+    def build(self, amr_corpus: dict) -> dict:
+        """
+        Parse every AMR of the corpus once and write it to the binary store.
+        Records are keyed by the full sentence id, e.g. PROXY_APW_ENG_20080514_1125.4
+        """
+        self.close()
+        index = {}
+        offset = 0
+        with open(self.data_file, 'wb') as outfile:
+            for dataset_name, dataset in amr_corpus.items():
+                for doc_name, doc in dataset.items():
+                    for amr_id, amr_data in doc.items():
+                        amr_obj = amr.AMR(amr_data['amr'], amr_data['tok'], lazy=True)
+                        triples = amr_obj.triples()
+                        position = {triple: i for i, triple in enumerate(triples)}
+                        record = (
+                            dataset_name,
+                            doc_name,
+                            amr_data['type'],
+                            list(amr_data['tok']),
+                            amr_data['amr'],
+                            [(encode_element(h), r, encode_element(d)) for h, r, d in triples],
+                            [(position[k], a) for k, a in amr_obj.alignments().items()],
+                            [(position[k], a) for k, a in amr_obj.role_alignments().items()]
+                        )
+                        data = pickle.dumps(record, -1)
+                        outfile.write(data)
+                        index[doc_name + '.' + amr_id] = (offset, len(data))
+                        offset += len(data)
+        # The index is written last, so a half-written store is never picked up by is_file_exist
+        with open(self.index_file, 'wb') as outfile:
+            pickle.dump(index, outfile, -1)
+        self.index = index
+        return index
+
+    def is_file_exist(self):
+        """
+        Checking whether the store files exist or not
+        """
+        return os.path.isfile(self.data_file) and os.path.isfile(self.index_file)
+
+    def open(self):
+        """
+        Load the id index and memory-map the record file
+        """
+        if self._mmap is not None:
+            return self
+        with open(self.index_file, 'rb') as infile:
+            self.index = pickle.load(infile)
+        self._infile = open(self.data_file, 'rb')
+        if os.path.getsize(self.data_file) > 0:
+            self._mmap = mmap.mmap(self._infile.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mmap = b''
+        return self
+
+    def close(self):
+        if self._mmap is not None and not isinstance(self._mmap, bytes):
+            self._mmap.close()
+        if self._infile is not None:
+            self._infile.close()
+        self._mmap = None
+        self._infile = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, snt_id):
+        self.open()
+        return snt_id in self.index
+
+    def __len__(self):
+        self.open()
+        return len(self.index)
+
+    def ids(self):
+        """
+        All sentence ids in the store, in corpus order
+        """
+        self.open()
+        return list(self.index.keys())
+
+    def get(self, snt_id: str) -> dict:
+        """
+        Materialize a single sentence. The result has the same fields as an amr_corpus entry plus the
+        pre-parsed 'triples', 'alignments' and 'role_alignments' of the graph.
+        """
+        self.open()
+        offset, length = self.index[snt_id]
+        dataset_name, doc_name, snt_type, tok, amr_string, enc_triples, align, role_align \
+            = pickle.loads(self._mmap[offset:offset + length])
+        elts = {}
+        triples = [(decode_element(h[0], h[1], elts), r, decode_element(d[0], d[1], elts))
+                   for h, r, d in enc_triples]
+        return {
+            'dataset': dataset_name,
+            'doc': doc_name,
+            'type': snt_type,
+            'tok': tok,
+            'amr': amr_string,
+            'triples': triples,
+            'alignments': {triples[i]: a for i, a in align},
+            'role_alignments': {triples[i]: a for i, a in role_align}
+        }
+
+    def get_amr(self, snt_id: str) -> amr.AMR:
+        """
+        Materialize a single sentence as an AMR object, without going through the Penman parser
+        """
+        record = self.get(snt_id)
+        return amr.AMR.from_triples(record['triples'], record['alignments'], record['role_alignments'],
+                                    record['tok'])
+
+
+if __name__ == '__main__':
+    from utils.AmrReader import AMRReader
+    amr_reader = AMRReader('/home/acp16hh/Data/abstract_meaning_representation_amr_2.0/',
+                           '/home/acp16hh/Projects/Research/Exp_7_Improve_CMap/dataset/output')
+    graph_store = AMRGraphStore('/home/acp16hh/Projects/Research/Exp_7_Improve_CMap/dataset/output')
+    graph_store.build(amr_reader.load_data())
@@ -4,146 +4,270 @@ Reader for AMR. Designed for proxy dataset in LDC2017T10.
 """
 import os
 import re
-import pickle
+import json
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from amr_hackathon.amr import AMR
+from utils.SegmentStore import SegmentStore
+from utils.TokenVocab import TokenStore
+
+
+def shard_of(doc_id, n_shards):
+    """
+    The shard a document belongs to. crc32 is stable across processes and hosts (unlike hash()),
+    so every run partitions the documents the same way.
+    """
+    return zlib.crc32(doc_id.encode('utf-8')) % n_shards
 
 
 class AMRReader:
 
-    def __init__(self, amr_path: str, output_path: str) :
+    def __init__(self, amr_path: str, output_path: str, splits=None, snt_types=None, doc_pattern=None, shard=None) :
         self.amr_corpus = {}
         self.amr_path = amr_path
         self.output_path = os.path.join(output_path, 'data')
         if not os.path.exists(self.output_path):
             os.makedirs(self.output_path)
+        # Filters applied while reading, None keeps everything
+        self.splits = set(splits) if splits else None
+        self.snt_types = set(snt_types) if snt_types else None
+        self.doc_pattern = re.compile(doc_pattern) if doc_pattern else None
+        # (i, n): only read the documents of shard i out of n
+        self.shard = shard
+        # amr_corpus.pickle, with the segments of appended documents
+        self.store = SegmentStore(self.output_path, 'amr_corpus')
+        # the filters the stored corpus was read with
+        self.filters_file = os.path.join(self.output_path, 'amr_corpus.filters.json')
+        # vocabulary and int32 ids of the sentence tokens, every 'tok' is a TokenView into it
+        self.token_store = TokenStore()
+
+    def is_selected(self, snt_id, snt_type):
+        """
+        Checking whether a sentence passes the sentence type and document id filters
+        """
+        if self.snt_types is not None and snt_type not in self.snt_types:
+            return False
+        doc_id = '.'.join(snt_id.split('.')[:-1])
+        if self.doc_pattern is not None and not self.doc_pattern.search(doc_id):
+            return False
+        if self.shard is not None and shard_of(doc_id, self.shard[1]) != self.shard[0]:
+            return False
+        return True
 
-    def build_corpus(self) -> dict:
+    def build_corpus(self, workers=1, parse_amr=False) -> dict:
         """
         Build corpus from alignments and amrs folder.
+        Only the splits, sentence types and documents selected by the filters are read.
+        With more than one worker, every split file is read (and with parse_amr, parsed) in its own process,
+        and gets its own TokenStore.
         """
+        amrs_files, align_files = self.find_split_files()
 
-        def extract_attr_file(file):
-            """
-            This function takes the non-alignment AMR and extract the sentence type. Only the non-alignment AMR file
-            contain the sentence type
-            """
-            first_line = True
-            snt_type = ''
-            snt_id = ''
-            amr_attr = {}
-            for line in file:
-                line = line.rstrip()
-                if line == '':
-                    # Only process line that contain snt_id and snt_type
-                    if not first_line:
-                        if snt_id != '':
-                            if snt_type:
-                                amr_attr[snt_id] = snt_type
-                            else:
-                                amr_attr[snt_id] = 'body'
-                    first_line = False
-
-                # Read sentence tokens
-                if line.startswith('#'):
-                    fields = line.split('::')
-                    for field in fields[1:]:
-                        tokens = field.split()
-                        if tokens[0] == 'id':
-                            snt_id = tokens[1]
-                        if tokens[0] == 'snt-type':
-                            snt_type = tokens[1]
+        if workers > 1 and len(align_files) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(align_files))) as executor:
+                futures = {split: executor.submit(self.read_split, amrs_files[split], align_file, parse_amr)
+                           for split, align_file in align_files.items()}
+                for split in align_files:
+                    self.amr_corpus[split] = futures[split].result()
+        else:
+            for split, align_file in align_files.items():
+                self.amr_corpus[split] = self.read_split(amrs_files[split], align_file, parse_amr)
+        return self.amr_corpus
+
+    def find_split_files(self):
+        """
+        The non-alignment and alignment proxy files of every selected split, indexed by split name
+        """
+        align_amr_path = os.path.join(self.amr_path, 'data/alignments/split')
+        amrs_path = os.path.join(self.amr_path, 'data/amrs/split')
+        amrs_files = {}
+        align_files = {}
+
+        for path, split_files in ((amrs_path, amrs_files), (align_amr_path, align_files)):
+            for root, dirs, files in os.walk(path):
+                for body_file in files:
+                    if 'proxy' in body_file:
+                        m = re.match(r'.*-(.*)-proxy.txt', body_file)
+                        if self.splits is not None and m.group(1) not in self.splits:
+                            continue
+                        split_files[m.group(1)] = os.path.join(root, body_file)
+        return amrs_files, align_files
+
+    def document_order(self) -> dict:
+        """
+        The document ids of every selected split in file order, read from the id lines only.
+        Used to put the documents of merged shards back in the order of an unsharded run.
+        """
+        order = {}
+        for split, align_file in self.find_split_files()[1].items():
+            doc_ids = {}
+            infile = open(align_file)
+            for line in infile:
+                if line.startswith('# ::id '):
+                    doc_ids['.'.join(line.split()[2].split('.')[:-1])] = None
+            infile.close()
+            order[split] = list(doc_ids)
+        return order
+
+    def read_split(self, amrs_file, align_file, parse_amr=False) -> dict:
+        """
+        Read the corpus of a single split, taking the sentence types from the non-alignment AMR file
+        """
+        infile = open(amrs_file)
+        amr_attr = self.extract_attr_file(infile)
+        infile.close()
+        infile = open(align_file)
+        corpus = self.load_amr(amr_attr, infile, parse_amr)
+        infile.close()
+        return corpus
+
+    def extract_attr_file(self, file):
+        """
+        This function takes the non-alignment AMR and extract the sentence type. Only the non-alignment AMR file
+        contain the sentence type
+        """
+        first_line = True
+        snt_type = ''
+        snt_id = ''
+        amr_attr = {}
+        for line in file:
+            line = line.rstrip()
+            if line == '':
+                # Only process line that contain snt_id and snt_type
+                if not first_line:
+                    if snt_id != '':
+                        if self.is_selected(snt_id, snt_type or 'body'):
+                            amr_attr[snt_id] = snt_type or 'body'
+                first_line = False
+
+            # Read sentence tokens
+            if line.startswith('#'):
+                fields = line.split('::')
+                for field in fields[1:]:
+                    tokens = field.split()
+                    if tokens[0] == 'id':
+                        snt_id = tokens[1]
+                    if tokens[0] == 'snt-type':
+                        snt_type = tokens[1]
+                continue
+        return amr_attr
+
+    def load_amr(self, amr_attr, file, parse_amr=False):
+        """
+        Read from the file and store it in corpus.
+        The corpus comprises of the processed nodes and tokens indexed by ID.
+        With parse_amr, the Penman string is also parsed into a (lazy) AMR object stored as 'amr_obj'
+        """
+
+        corpus = {}
+        amr_string = ''
+        snt_tok = ''
+        amr_counter = 0
+        # graphs of sentences that are not selected are skipped without being accumulated
+        skip = False
+        for line in file:
+            line = line.rstrip()
+            # Every AMR graph is ended by an empty line
+            if line == '':
+                # This happen on the first line of the file
+                if amr_string == '':
                     continue
-            return amr_attr
-
-        def load_amr(amr_attr, file):
-            """
-            Read from the file and store it in corpus.
-            The corpus comprises of the processed nodes and tokens indexed by ID
-            """
-
-            corpus = {}
-            amr_string = ''
-            snt_tok = ''
-            amr_counter = 0
-            for line in file:
-                line = line.rstrip()
-                # Every AMR graph is ended by an empty line
-                if line == '':
-                    # This happen on the first line of the file
-                    if amr_string == '':
-                        continue
-                    else:
-                        if snt_id in amr_attr:
-                            doc_id = '.'.join(snt_id.split('.')[:-1])
-                            body_corpus = corpus.setdefault(doc_id, {})
-                            result = re.match(r'.*\.(.*)', snt_id)
-                            amr = {
-                                'type': amr_attr[snt_id],
-                                'tok': snt_tok,
-                                'amr': amr_string
-                            }
-                            body_corpus[result.group(1)] = amr
-                            corpus[doc_id] = body_corpus
-                            amr_counter += 1
-                        amr_string = ''
-                        continue
-
-                # Read sentence tokens
-                if line.startswith('#'):
-                    fields = line.split('::')
-                    for field in fields[1:]:
-                        tokens = field.split()
-                        if tokens[0] == 'id':
-                            snt_id = tokens[1]
-                        if tokens[0] == 'tok':
-                            snt_tok = tokens[1:]
+                else:
+                    if snt_id in amr_attr:
+                        doc_id = '.'.join(snt_id.split('.')[:-1])
+                        body_corpus = corpus.setdefault(doc_id, {})
+                        result = re.match(r'.*\.(.*)', snt_id)
+                        amr = {
+                            'type': amr_attr[snt_id],
+                            'tok': self.token_store.add(snt_tok),
+                            'amr': amr_string
+                        }
+                        if parse_amr:
+                            amr['amr_obj'] = AMR(amr_string, amr['tok'], lazy=True)
+                        body_corpus[result.group(1)] = amr
+                        corpus[doc_id] = body_corpus
+                        amr_counter += 1
+                    amr_string = ''
                     continue
 
-                # If line is not start by # and not empty means it's part of AMR graph
+            # Read sentence tokens
+            if line.startswith('#'):
+                fields = line.split('::')
+                for field in fields[1:]:
+                    tokens = field.split()
+                    if tokens[0] == 'id':
+                        snt_id = tokens[1]
+                        skip = snt_id not in amr_attr
+                    if tokens[0] == 'tok':
+                        snt_tok = tokens[1:]
+                continue
+
+            # If line is not start by # and not empty means it's part of AMR graph
+            if not skip:
                 amr_string += line + '\n'
 
-            return corpus
+        return corpus
 
-        align_amr_path = os.path.join(self.amr_path, 'data/alignments/split')
-        amrs_path = os.path.join(self.amr_path, 'data/amrs/split')
-        file_type = {}
-
-        for root, dirs, files in os.walk(amrs_path):
-            for body_file in files:
-                if 'proxy' in body_file:
-                    infile = open(os.path.join(root, body_file))
-                    m = re.match(r'.*-(.*)-proxy.txt', body_file)
-                    file_type[m.group(1)] = extract_attr_file(infile)
-
-        for root, dirs, files in os.walk(align_amr_path):
-            for body_file in files:
-                if 'proxy' in body_file:
-                    infile = open(os.path.join(root, body_file))
-                    m = re.match(r'.*-(.*)-proxy.txt', body_file)
-                    self.amr_corpus[m.group(1)] = load_amr(file_type[m.group(1)], infile)
-        return self.amr_corpus
+    def stored_corpus(self) -> dict:
+        """
+        The corpus without the parsed AMR objects, which are not stored
+        """
+        return {dataset_name: {doc_name: {amr_id: {k: v for k, v in amr_data.items() if k != 'amr_obj'}
+                                          for amr_id, amr_data in doc.items()}
+                               for doc_name, doc in dataset.items()}
+                for dataset_name, dataset in self.amr_corpus.items()}
+
+    def filters(self) -> dict:
+        """
+        The split, sentence type, document and shard filters of this reader
+        """
+        return {'splits': sorted(self.splits) if self.splits else None,
+                'snt_types': sorted(self.snt_types) if self.snt_types else None,
+                'doc_pattern': self.doc_pattern.pattern if self.doc_pattern else None,
+                'shard': list(self.shard) if self.shard else None}
+
+    def save_filters(self):
+        """
+        Record the filters of this reader as the ones the stored corpus was read with
+        """
+        output_file = open(self.filters_file, 'w')
+        json.dump(self.filters(), output_file)
+        output_file.close()
 
     def save_data(self):
         """
-        Dumping the amr corpus into pickle file
+        Dumping the amr corpus into pickle file, with the filters it was read with. Parsed AMR objects are not
+        stored.
         """
         # TODO: Replace pickle with h5py
-        output_file = open(os.path.join(self.output_path, 'amr_corpus.pickle'), 'wb')
-        pickle.dump(self.amr_corpus, output_file, -1)
+        self.store.save(self.stored_corpus())
+        self.save_filters()
+
+    def append_data(self):
+        """
+        Append the documents read by this reader to the stored corpus, as a new segment
+        """
+        self.store.append(self.stored_corpus())
 
     def load_data(self):
         """
-        Loading the amr corpus from pickle file
+        Loading the amr corpus from pickle file, with its appended segments
         """
         # TODO: Replace pickle with h5py
-        infile = open(os.path.join(self.output_path, 'amr_corpus.pickle'), 'rb')
-        self.amr_corpus = pickle.load(infile)
+        self.amr_corpus = self.store.load()
         return self.amr_corpus
 
     def is_file_exist(self):
         """
-        Checking whether the file exist or not
+        Checking whether the file exist or not, and was read with the filters of this reader
         """
-        return os.path.isfile(os.path.join(self.output_path, 'amr_corpus.pickle'))
+        if not (os.path.isfile(os.path.join(self.output_path, 'amr_corpus.pickle'))
+                and os.path.isfile(self.filters_file)):
+            return False
+        infile = open(self.filters_file)
+        filters = json.load(infile)
+        infile.close()
+        return filters == self.filters()
 
 if __name__ == '__main__':
     amr_reader = AMRReader('/home/acp16hh/Data/abstract_meaning_representation_amr_2.0/',
@@ -29,6 +29,31 @@ class PropBankReader:
                 self.propbank[roleset_id] = roleset
         return self.propbank
 
+    def agent_table(self):
+        """
+        Compact table mapping every roleset id to the numbers of its agent ('pag') arguments.
+        It is cached in propbank_agents.pickle, so later runs do not load the DOM trees at all.
+        """
+        table_path = os.path.join(self.output_path, 'propbank_agents.pickle')
+        if os.path.isfile(table_path):
+            infile = open(table_path, 'rb')
+            table = pickle.load(infile)
+            infile.close()
+            return table
+        if not self.propbank:
+            if self.is_file_exist():
+                self.load_data()
+            else:
+                self.build_data()
+        table = {}
+        for roleset_id, roleset in self.propbank.items():
+            table[roleset_id] = frozenset(dict(role.attributes)['n'].value for role in roleset.getElementsByTagName('role')
+                                          if dict(role.attributes)['f'].value.lower() == 'pag')
+        output_file = open(table_path, 'wb')
+        pickle.dump(table, output_file, -1)
+        output_file.close()
+        return table
+
     def is_file_exist(self):
         """
         Checking whether the file exist or not
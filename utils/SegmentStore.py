@@ -0,0 +1,139 @@
+"""
+Append-only pickle store of a corpus indexed by dataset then document, e.g. amr_corpus.pickle.
+The base pickle keeps its usual name and format. New documents are appended as segment pickles in
+<name>.segments/ and listed in the catalog <name>.segments.json, so an append only writes the new documents.
+Loading merges the segments onto the base in order, a document of a later segment replacing an earlier copy.
+Compaction folds the segments back into the base pickle.
+
+Readers get a consistent snapshot: the catalog is replaced atomically, and a generation number in it is odd
+while the base is being replaced (seqlock style). A reader retries when the generation was odd or changed, or
+when a segment it listed was removed by a compaction meanwhile. There is a single writer.
+"""
+import os
+import json
+import time
+import pickle
+
+
+def merge_corpus(corpus, segment):
+    """
+    Merge a segment into a corpus by document, in place
+    """
+    for dataset_name, dataset in segment.items():
+        corpus.setdefault(dataset_name, {}).update(dataset)
+    return corpus
+
+
+class SegmentStore:
+
+    def __init__(self, dir_path, name, max_segments=16):
+        self.dir_path = dir_path
+        self.base_file = os.path.join(dir_path, name + '.pickle')
+        self.segment_path = os.path.join(dir_path, name + '.segments')
+        self.catalog_file = self.segment_path + '.json'
+        # appending past max_segments compacts the store
+        self.max_segments = max_segments
+
+    def read_catalog(self) -> dict:
+        if not os.path.isfile(self.catalog_file):
+            return {'generation': 0, 'segments': [], 'next': 0}
+        infile = open(self.catalog_file)
+        catalog = json.load(infile)
+        infile.close()
+        return catalog
+
+    def write_catalog(self, catalog):
+        tmp_path = self.catalog_file + '.tmp'
+        output_file = open(tmp_path, 'w')
+        json.dump(catalog, output_file)
+        output_file.close()
+        os.replace(tmp_path, self.catalog_file)
+
+    @staticmethod
+    def dump(data, path):
+        # write then rename, so the pickle is either the old or the new one
+        tmp_path = path + '.tmp'
+        output_file = open(tmp_path, 'wb')
+        pickle.dump(data, output_file, -1)
+        output_file.close()
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read(path):
+        infile = open(path, 'rb')
+        data = pickle.load(infile)
+        infile.close()
+        return data
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.base_file)
+
+    def files(self) -> list:
+        """
+        The base and segment files of the current snapshot
+        """
+        return [self.base_file] + [os.path.join(self.segment_path, s) for s in self.read_catalog()['segments']]
+
+    def save(self, corpus):
+        """
+        Replace the whole store by corpus, dropping the segments
+        """
+        catalog = self.read_catalog()
+        old_segments = catalog['segments']
+        catalog['generation'] += 1
+        self.write_catalog(catalog)
+        self.dump(corpus, self.base_file)
+        catalog['generation'] += 1
+        catalog['segments'] = []
+        self.write_catalog(catalog)
+        for segment in old_segments:
+            os.remove(os.path.join(self.segment_path, segment))
+
+    def append(self, corpus):
+        """
+        Append the documents of corpus as a new segment, returns the segment file
+        """
+        if not self.exists():
+            self.save(corpus)
+            return self.base_file
+        if not os.path.exists(self.segment_path):
+            os.makedirs(self.segment_path)
+        catalog = self.read_catalog()
+        segment = '%06d.pickle' % catalog['next']
+        path = os.path.join(self.segment_path, segment)
+        self.dump(corpus, path)
+        catalog['segments'].append(segment)
+        catalog['next'] += 1
+        self.write_catalog(catalog)
+        if len(catalog['segments']) > self.max_segments:
+            self.compact()
+        return path
+
+    def load(self, retries=100):
+        """
+        The corpus of a consistent snapshot of the base and its segments
+        """
+        # the base is replaced atomically and never removed, without it there is no store
+        if not self.exists():
+            raise FileNotFoundError('No corpus store at ' + self.base_file)
+        for _ in range(retries):
+            catalog = self.read_catalog()
+            if catalog['generation'] % 2 == 0:
+                corpus = self.read(self.base_file)
+                try:
+                    for segment in catalog['segments']:
+                        merge_corpus(corpus, self.read(os.path.join(self.segment_path, segment)))
+                except FileNotFoundError:
+                    # a compaction removed a segment of this snapshot meanwhile
+                    corpus = None
+                if corpus is not None and self.read_catalog()['generation'] == catalog['generation']:
+                    return corpus
+            time.sleep(0.05)
+        raise Exception('No consistent snapshot of ' + self.base_file + ', it is being rewritten')
+
+    def compact(self):
+        """
+        Fold the segments into the base pickle
+        """
+        if self.read_catalog()['segments']:
+            self.save(self.load())
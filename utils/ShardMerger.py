@@ -0,0 +1,94 @@
+"""
+Sharded runs of amr_cmap. With --shard i/n a run only reads the documents of shard i (see AmrReader.shard_of)
+and writes its outputs to output_path/shards/<i>_of_<n>. The merger combines the pickles of all shards
+into output_path/data, with the documents in the order of an unsharded run, so the token and AMR-string
+files can then be written from the merged corpus as usual.
+"""
+import os
+import pickle
+from utils.SegmentStore import SegmentStore
+
+
+def parse_shard(spec):
+    """
+    Parse a shard specification i/n
+
+    >>> parse_shard('2/4')
+    (2, 4)
+    """
+    try:
+        i, n = (int(x) for x in spec.split('/'))
+    except ValueError:
+        raise Exception('Invalid shard ' + spec + ', expected i/n')
+    if n < 1 or not 0 <= i < n:
+        raise Exception('Invalid shard ' + spec + ', expected 0 <= i < n')
+    return i, n
+
+
+def shard_output_path(output_path, i, n):
+    return os.path.join(output_path, 'shards', str(i) + '_of_' + str(n))
+
+
+class ShardMerger:
+
+    # pickles of AMRReader, AMRCorpusExtConverter and the merged cmaps, all indexed by dataset then document
+    CORPUS_FILES = ('amr_corpus.pickle', 'amr_corpus_ext.pickle', 'amr_cmaps.pickle')
+    # the corpus pickles kept in a SegmentStore
+    STORE_FILES = ('amr_corpus.pickle', 'amr_corpus_ext.pickle')
+
+    def __init__(self, output_path, n_shards, document_order):
+        self.output_path = os.path.join(output_path, 'data')
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+        self.shard_paths = [os.path.join(shard_output_path(output_path, i, n_shards), 'data')
+                            for i in range(n_shards)]
+        # dataset -> document ids in file order, from AMRReader.document_order
+        self.document_order = document_order
+
+    def merge_file(self, file_name):
+        """
+        Merge one pickle of every shard, returns False if a shard did not write it
+        """
+        paths = [os.path.join(path, file_name) for path in self.shard_paths]
+        if not all(os.path.isfile(path) for path in paths):
+            return False
+        merged_docs = {}
+        for path in paths:
+            if file_name in self.STORE_FILES:
+                # with the segments appended to the shard
+                shard = SegmentStore(os.path.dirname(path), file_name[:-len('.pickle')]).load()
+            else:
+                infile = open(path, 'rb')
+                shard = pickle.load(infile)
+                infile.close()
+            for dataset_name, dataset in shard.items():
+                merged_docs.setdefault(dataset_name, {}).update(dataset)
+        merged = {}
+        # documents (and datasets) that are not in the AMR files of this run, e.g. appended ones, come last
+        for dataset_name in list(self.document_order) + [d for d in merged_docs if d not in self.document_order]:
+            if dataset_name not in merged_docs:
+                continue
+            docs = merged_docs[dataset_name]
+            merged[dataset_name] = {doc_id: docs.pop(doc_id) for doc_id in self.document_order.get(dataset_name, ())
+                                    if doc_id in docs}
+            merged[dataset_name].update(docs)
+        if file_name in self.STORE_FILES:
+            # also drops any segments appended to the previous corpus
+            SegmentStore(self.output_path, file_name[:-len('.pickle')]).save(merged)
+            return True
+        output_file = open(os.path.join(self.output_path, file_name), 'wb')
+        pickle.dump(merged, output_file, -1)
+        output_file.close()
+        return True
+
+    def merge(self):
+        """
+        Merge the corpus pickles of all shards, returns the names of the merged files
+        """
+        merged = []
+        for file_name in self.CORPUS_FILES:
+            if self.merge_file(file_name):
+                merged.append(file_name)
+            elif file_name == 'amr_corpus.pickle':
+                raise Exception('Missing shard outputs in ' + os.path.dirname(self.output_path))
+        return merged
@@ -0,0 +1,107 @@
+"""
+Make-style bookkeeping of the amr_cmap stages.
+Every stage is identified by a fingerprint of its inputs (input files, the PropBank frames, parameters,
+the fingerprints of the stages it depends on and the source code of the modules it runs). The manifest,
+data/manifest.json, records for each stage the fingerprint it was built from and its output files, so a
+stage only re-runs when its inputs changed or its outputs are missing or were modified.
+"""
+import os
+import json
+import inspect
+import hashlib
+
+
+def file_fingerprint(path, content=False) -> str:
+    """
+    Fingerprint of a file: its size and modification time, or with content the sha1 of its bytes
+    """
+    if content:
+        sha1 = hashlib.sha1()
+        infile = open(path, 'rb')
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha1.update(block)
+        infile.close()
+        return sha1.hexdigest()
+    stat = os.stat(path)
+    return str(stat.st_size) + ':' + str(stat.st_mtime_ns)
+
+
+def files_fingerprint(paths, content=False) -> dict:
+    return {path: file_fingerprint(path, content) for path in sorted(paths)}
+
+
+def dir_fingerprint(path, content=False) -> dict:
+    """
+    Fingerprint of every file under a directory, by relative path
+    """
+    fingerprints = {}
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            fingerprints[os.path.relpath(file_path, path)] = file_fingerprint(file_path, content)
+    return dict(sorted(fingerprints.items()))
+
+
+def code_fingerprint(*modules) -> str:
+    """
+    sha1 of the source files of the given modules (modules, classes or functions, or file paths)
+    """
+    sha1 = hashlib.sha1()
+    for module in modules:
+        path = module if isinstance(module, str) else inspect.getsourcefile(module)
+        infile = open(path, 'rb')
+        sha1.update(infile.read())
+        infile.close()
+    return sha1.hexdigest()
+
+
+class StageManifest:
+
+    def __init__(self, output_path):
+        self.output_path = os.path.join(output_path, 'data')
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+        self.path = os.path.join(self.output_path, 'manifest.json')
+        self.stages = {}
+        if os.path.isfile(self.path):
+            infile = open(self.path)
+            self.stages = json.load(infile)
+            infile.close()
+
+    @staticmethod
+    def fingerprint(inputs) -> str:
+        """
+        Fingerprint of a stage from its (JSON serializable) inputs
+        """
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_current(self, stage, fingerprint) -> bool:
+        """
+        Checking whether a stage was built from the same inputs and its outputs are unchanged
+        """
+        entry = self.stages.get(stage)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        for path, output_fingerprint in entry['outputs'].items():
+            if not os.path.isfile(path) or file_fingerprint(path) != output_fingerprint:
+                return False
+        return True
+
+    def record(self, stage, fingerprint, outputs):
+        """
+        Record the fingerprint and output files of a stage that was (re)built
+        """
+        self.stages[stage] = {'fingerprint': fingerprint, 'outputs': files_fingerprint(outputs)}
+        self.save_data()
+
+    def invalidate(self, stage):
+        if self.stages.pop(stage, None) is not None:
+            self.save_data()
+
+    def save_data(self):
+        # write then rename, so an interrupted run never leaves a truncated manifest
+        tmp_path = self.path + '.tmp'
+        output_file = open(tmp_path, 'w')
+        json.dump(self.stages, output_file, indent=2, sort_keys=True)
+        output_file.close()
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,73 @@
+"""
+Integer-coded storage of the sentence tokens of a corpus.
+A TokenStore keeps one vocabulary of the token strings while the corpus is read, and the 'tok' of every sentence
+is a TokenView: the int32 ids of its own tokens and a reference to the shared vocabulary, decoded on access,
+instead of a list of strings. A view holds nothing of the other sentences, so one that outlives its corpus only
+keeps its ids and the vocabulary alive.
+"""
+from array import array
+from collections.abc import Sequence
+
+
+class TokenStore:
+
+    def __init__(self):
+        self.words = []
+        self.word_ids = {}
+
+    def add(self, tokens):
+        """
+        Store the tokens of a sentence, returns its TokenView
+
+        >>> store = TokenStore()
+        >>> tok = store.add('the cat saw the dog'.split())
+        >>> len(tok), tok[1], tok[3:], list(tok.ids), store.words
+        (5, 'cat', ['the', 'dog'], [0, 1, 2, 0, 3], ['the', 'cat', 'saw', 'dog'])
+        >>> tok == ['the', 'cat', 'saw', 'the', 'dog'], ' '.join(tok)
+        (True, 'the cat saw the dog')
+        """
+        word_ids = self.word_ids
+        ids = array('i')
+        for token in tokens:
+            word_id = word_ids.get(token)
+            if word_id is None:
+                word_id = word_ids[token] = len(self.words)
+                self.words.append(token)
+            ids.append(word_id)
+        return TokenView(self.words, ids)
+
+
+class TokenView(Sequence):
+    """
+    The tokens of one sentence, as a read-only sequence of strings: the ids of its tokens in a vocabulary
+    """
+    __slots__ = ('words', 'ids')
+
+    def __init__(self, words, ids):
+        self.words = words
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.words[word_id] for word_id in self.ids[i]]
+        return self.words[self.ids[i]]
+
+    def __iter__(self):
+        return map(self.words.__getitem__, self.ids)
+
+    def __eq__(self, other):
+        if isinstance(other, (TokenView, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        # a vocabulary shared by the views of a pickle is stored once
+        return TokenView, (self.words, self.ids)